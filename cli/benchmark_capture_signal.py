@@ -0,0 +1,125 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+# Micro-benchmarks for the pieces that make up the capture signal
+
+import os
+import time
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+from toan.music.chord import ChordType
+from toan.signal.capture_signal import (
+    CaptureSignalConfig,
+    _generate_plucked_chord,
+    generate_capture_signal,
+)
+from toan.signal.effect.delay import effect_delay
+from toan.signal.generator.pluck_scale import generate_named_chord_pluck_scale
+
+
+@dataclass
+class _Benchmark:
+    name: str
+    run: Callable[[], object]
+
+
+def _build_benchmarks(sample_rate: int) -> list[_Benchmark]:
+    config = CaptureSignalConfig()
+    noise = np.random.default_rng(0x35).uniform(-1.0, 1.0, sample_rate * 30)
+    delay_samples = int(sample_rate * 0.4)
+
+    return [
+        _Benchmark(
+            "effect_delay/feedforward_0400",
+            lambda: effect_delay(noise, delay_samples, 0.5, False),
+        ),
+        _Benchmark(
+            "effect_delay/feedback_0400",
+            lambda: effect_delay(noise, delay_samples, 0.4, True),
+        ),
+        _Benchmark(
+            "effect_delay/feedback_short",
+            lambda: effect_delay(noise, 64, 0.4, True),
+        ),
+        _Benchmark(
+            "pluck/major_triad_scale",
+            lambda: generate_named_chord_pluck_scale(
+                ChordType.MajorTriad,
+                sample_rate,
+                "E",
+                1,
+                "G",
+                6,
+                config.pluck_note_duration,
+                decay=config.pluck_decay,
+                pre_smooth=config.pluck_pre_smooth,
+            ),
+        ),
+        _Benchmark(
+            "capture/plucked_chord",
+            lambda: _generate_plucked_chord(
+                sample_rate,
+                config.plucked_chords[-1],
+                len(config.plucked_chords) - 1,
+                config.pluck_note_duration,
+                config.pluck_decay,
+                config.pluck_pre_smooth,
+            ),
+        ),
+        _Benchmark(
+            "capture/full",
+            lambda: generate_capture_signal(sample_rate, config),
+        ),
+        _Benchmark(
+            "capture/full_parallel",
+            lambda: generate_capture_signal(sample_rate, config, os.cpu_count()),
+        ),
+    ]
+
+
+def main() -> None:
+    arg_parser = ArgumentParser(
+        description="Time the generation of the capture signal and its parts",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    arg_parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of timed runs of each benchmark",
+    )
+    arg_parser.add_argument(
+        "--samplerate",
+        type=int,
+        default=48000,
+        help="Sample rate of the generated signals",
+    )
+    arg_parser.add_argument(
+        "--filter",
+        type=str,
+        default="",
+        help="Only run benchmarks whose name contains this string",
+    )
+    args = arg_parser.parse_args()
+
+    for benchmark in _build_benchmarks(args.samplerate):
+        if args.filter not in benchmark.name:
+            continue
+        timings = []
+        for _ in range(args.repeat):
+            time_begin = time.perf_counter()
+            benchmark.run()
+            timings.append(time.perf_counter() - time_begin)
+        print(
+            f"{benchmark.name:<32} min: {min(timings) * 1000:9.2f} ms"
+            f"  median: {np.median(timings) * 1000:9.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
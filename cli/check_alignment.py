@@ -0,0 +1,137 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+# Checks that fine alignment recovers a known fractional latency and clock drift
+# from a synthetic capture
+
+import sys
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from dataclasses import dataclass
+
+import numpy as np
+
+from toan.signal.align import SignalAlignment, align_wet_signal, estimate_alignment
+from toan.signal.analysis import find_dry_clicks, find_wet_clicks
+
+
+@dataclass
+class _AlignmentCase:
+    latency: float
+    drift: float
+
+
+_CASES = [
+    _AlignmentCase(137.4, 0.0),
+    _AlignmentCase(88.25, 0.0),
+    _AlignmentCase(251.7, 25e-6),
+    _AlignmentCase(60.6, -30e-6),
+]
+
+_LATENCY_TOLERANCE = 0.1
+_DRIFT_TOLERANCE = 0.5e-6
+
+
+def _build_dry_signal(sample_rate: int, seconds: int) -> np.ndarray:
+    # Two clicks in the first three seconds then noise, like the capture signal
+    rng = np.random.default_rng(0x35)
+    dry = np.zeros(sample_rate * seconds, dtype=np.float32)
+    dry[sample_rate] = 0.5
+    dry[sample_rate * 2] = 0.5
+    dry[sample_rate * 4 :] = rng.uniform(-0.2, 0.2, len(dry) - sample_rate * 4)
+    return dry
+
+
+def _delay_signal(
+    dry: np.ndarray, case: _AlignmentCase, sample_rate: int
+) -> np.ndarray:
+    padded = np.concatenate([dry, np.zeros(sample_rate, dtype=np.float32)])
+    if case.drift == 0.0:
+        # Band-limited delay in the frequency domain, clicks ring either side of
+        # their position as they would through an ADC
+        spectrum = np.fft.rfft(padded)
+        frequencies = np.fft.rfftfreq(len(padded))
+        spectrum *= np.exp(-2j * np.pi * frequencies * case.latency)
+        return np.fft.irfft(spectrum, len(padded)).astype(np.float32)
+    inverse = SignalAlignment(
+        latency=-case.latency, drift=-case.drift, reference=sample_rate
+    )
+    return align_wet_signal(padded, inverse, 0, len(padded))
+
+
+def _check_case(dry: np.ndarray, case: _AlignmentCase, sample_rate: int) -> bool:
+    wet = _delay_signal(dry, case, sample_rate)
+    clicks_end = sample_rate * 3
+    dry_clicks = find_dry_clicks(dry[:clicks_end])
+    wet_clicks = find_wet_clicks(wet[:clicks_end], sample_rate // 2, dry_clicks.delta)
+    if wet_clicks is None:
+        print(f"  latency={case.latency} drift={case.drift * 1e6:g}ppm  FAIL (clicks)")
+        return False
+    coarse_latency = wet_clicks.first_click - dry_clicks.first_click
+    alignment = estimate_alignment(
+        dry,
+        wet,
+        coarse_latency,
+        (0, clicks_end),
+        [(sample_rate * 4, len(dry))],
+    )
+    if alignment is None:
+        print(f"  latency={case.latency} drift={case.drift * 1e6:g}ppm  FAIL (none)")
+        return False
+    # Compare where each dry sample lands in the wet signal at the reference
+    true_position = (
+        alignment.reference
+        + case.latency
+        + case.drift * (alignment.reference - sample_rate)
+    )
+    latency_error = alignment.wet_position(alignment.reference) - true_position
+    drift_error = alignment.drift - case.drift
+    ok = (
+        abs(latency_error) <= _LATENCY_TOLERANCE
+        and abs(drift_error) <= _DRIFT_TOLERANCE
+    )
+    status = "OK" if ok else "FAIL"
+    print(
+        f"  latency={case.latency} drift={case.drift * 1e6:g}ppm "
+        f"click={coarse_latency} estimated={alignment.latency:.3f} "
+        f"latency_error={latency_error:+.3f} "
+        f"drift_error={drift_error * 1e6:+.3f}ppm  {status}"
+    )
+    return ok
+
+
+def main() -> int:
+    arg_parser = ArgumentParser(
+        description="Check fine alignment against synthetic captures with a known "
+        "latency and clock drift.",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    arg_parser.add_argument(
+        "--samplerate",
+        type=int,
+        default=48000,
+        help="Sample rate of the synthetic capture",
+    )
+    arg_parser.add_argument(
+        "--seconds",
+        type=int,
+        default=60,
+        help="Length of the synthetic capture",
+    )
+    args = arg_parser.parse_args()
+
+    dry = _build_dry_signal(args.samplerate, args.seconds)
+    all_ok = True
+    for case in _CASES:
+        all_ok = _check_case(dry, case, args.samplerate) and all_ok
+
+    print()
+    if all_ok:
+        print("PASS: alignment recovered every latency and drift.")
+        return 0
+    print("FAIL: alignment did not recover every latency and drift.")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import sys
+import time
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+import soundfile as sf
+
+from toan.model.metadata import ModelA2Metadata
+from toan.model.nam_a2_wavenet_config import json_a2_wavenet_container_config
+from toan.model.nam_a2_wavenet_render_torch import (
+    DEFAULT_RENDER_CHUNK_SIZE,
+    render_nam_a2,
+)
+from toan.model.nam_a2_wavenet_torch import NamA2WaveNetTorch
+from toan.persistence.nam_file import load_nam_json
+from toan.training.device_torch import TorchDeviceType, get_torch_device
+from toan.wav import load_and_resample_wav
+
+
+def main() -> int:
+    arg_parser = ArgumentParser(
+        description="Render a WAV/FLAC file through an A2 .nam file.",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    arg_parser.add_argument("nam_path", type=str, help="Path to an A2 .nam file")
+    arg_parser.add_argument("input_path", type=str, help="Input WAV/FLAC file")
+    arg_parser.add_argument("output_path", type=str, help="Output WAV/FLAC file")
+    arg_parser.add_argument(
+        "--submodel",
+        type=int,
+        default=None,
+        help="Index of the submodel to render, defaults to the largest",
+    )
+    arg_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_RENDER_CHUNK_SIZE,
+        help="Output samples rendered per chunk",
+    )
+    arg_parser.add_argument(
+        "--threads",
+        type=int,
+        default=0,
+        help="Chunks rendered in parallel, 0 renders them one at a time",
+    )
+    arg_parser.add_argument(
+        "--device",
+        type=str,
+        default=TorchDeviceType.Cpu.get_label(),
+        choices=[device_type.get_label() for device_type in TorchDeviceType],
+        help="Torch device used to render",
+    )
+    args = arg_parser.parse_args()
+
+    print("Loading nam file...")
+    root = load_nam_json(args.nam_path)
+
+    architecture = root.get("architecture")
+    if architecture != "SlimmableContainer":
+        print(
+            f"Error: expected an A2 (SlimmableContainer) profile, got "
+            f"architecture={architecture!r}."
+        )
+        return 2
+
+    config = json_a2_wavenet_container_config(root["config"])
+    metadata = ModelA2Metadata(name="", gear_make="", gear_model="")
+    model = NamA2WaveNetTorch(config, metadata, float(root["sample_rate"]))
+    model.import_nam_linear_weights(
+        [entry["model"]["weights"] for entry in root["config"]["submodels"]]
+    )
+    model.to(get_torch_device(TorchDeviceType.from_label(args.device)))
+    model.eval()
+
+    print("Loading input...")
+    signal = load_and_resample_wav(model.sample_rate, args.input_path)
+
+    print(f"Rendering {len(signal)} samples...")
+    time_begin = time.perf_counter()
+    output = render_nam_a2(
+        model,
+        signal,
+        args.submodel,
+        args.chunk_size,
+        args.threads,
+        pad_history=True,
+    )
+    elapsed = time.perf_counter() - time_begin
+    print(f"Rendered in {elapsed:.2f}s ({len(output) / elapsed:.0f} samples/s)")
+
+    sf.write(args.output_path, output, model.sample_rate)
+    print(f"Wrote {args.output_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
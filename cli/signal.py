@@ -17,12 +17,9 @@ import numpy as np
 from toan.model.nam_a2_wavenet_presets import get_a2_wavenet_config
 from toan.model.presets import ModelConfigPreset
 from toan.music.chord import ChordType
+from toan.persistence.capture_signal_cache import get_capture_signal_cached
 from toan.persistence.user_wav import load_user_wav_list
-from toan.signal.capture_signal import (
-    CaptureSignalConfig,
-    ChordWithEffects,
-    generate_capture_signal,
-)
+from toan.signal.capture_signal import CaptureSignalConfig, ChordWithEffects
 from toan.signal.effect import EffectType
 from toan.signal.mix import concat_signals
 from toan.soundio import SdChannel, get_input_devices, get_output_devices
@@ -90,9 +87,12 @@ def _synthezise_and_record(
     signal_config: CaptureSignalConfig,
     extra_signal_train: np.ndarray | None,
     extra_signal_test: np.ndarray | None,
+    workers: int,
 ) -> io.BytesIO | None:
     print("Generating signal...")
-    capture_signal_details = generate_capture_signal(sample_rate, signal_config)
+    capture_signal_details = get_capture_signal_cached(
+        sample_rate, signal_config, workers
+    )
     signal_dry = capture_signal_details.signal
     if extra_signal_train is not None:
         print(f"Adding extra training signal of {len(extra_signal_train)} samples...")
@@ -223,6 +223,12 @@ def main() -> None:
         type=str,
         help="Comma separated list of training wavs",
     )
+    arg_parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Processes used to generate the capture signal, 0 generates it serially",
+    )
     args = arg_parser.parse_args()
 
     input_channel = _parse_colon_syntax(args.input)
@@ -279,6 +285,7 @@ def main() -> None:
                 capture_config,
                 train_extra_in,
                 test_wav_extra,
+                args.workers,
             )
             if zip_buffer is None:
                 print("Reporting 100 loss for this recording")
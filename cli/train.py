@@ -17,6 +17,7 @@ from toan.model.nam_a2_wavenet_presets import get_a2_wavenet_config
 from toan.model.presets import ModelConfigPreset
 from toan.training.config import TrainingConfig, get_training_config_from_preset
 from toan.training.context import TrainingProgressContext
+from toan.training.device_torch import TorchDeviceType
 from toan.training.loop_torch import run_training_loop_torch
 from toan.training.zip_loader import ZipLoaderContext, run_zip_loader
 
@@ -54,6 +55,30 @@ def main():
         formatter_class=ArgumentDefaultsHelpFormatter,
     )
     arg_parser.add_argument("zip_path", type=str, help="Path to recording zip file")
+    arg_parser.add_argument(
+        "--device",
+        type=str,
+        default=TorchDeviceType.Auto.get_label(),
+        choices=[device_type.get_label() for device_type in TorchDeviceType],
+        help="Torch device to train on",
+    )
+    arg_parser.add_argument(
+        "--threads",
+        type=int,
+        default=0,
+        help="Intra-op thread count for cpu training, 0 uses the torch default",
+    )
+    arg_parser.add_argument(
+        "--interop-threads",
+        type=int,
+        default=0,
+        help="Inter-op thread count for cpu training, 0 uses the torch default",
+    )
+    arg_parser.add_argument(
+        "--bf16",
+        action="store_true",
+        help="Use bfloat16 autocast for the forward pass when training on the cpu",
+    )
 
     args = arg_parser.parse_args()
 
@@ -99,6 +124,9 @@ def main():
                     progress_bar.update(train_context.iters_done - progress_bar.n)
                 time.sleep(1.0)
 
+        if train_context.steps_per_second is not None:
+            print(f"Steps per second: {train_context.steps_per_second:0.3f}")
+
         if save_model:
             print("Training complete, saving model...")
             model_root_path = f"./output/{name}"
@@ -108,7 +136,7 @@ def main():
             fig.savefig(graph_path)
             model_path = f"{model_root_path}/model.nam"
             with open(model_path, "w") as file:
-                file.write(train_context.model.export_nam_json_str())
+                train_context.model.export_nam_json(file)
 
         if train_context.loss_test is not None:
             return train_context.loss_test
@@ -145,6 +173,10 @@ def main():
 
     train_config = get_training_config_from_preset(THE_PRESET)
     train_config.stages[0].test_interval = 0
+    train_config.device = TorchDeviceType.from_label(args.device)
+    train_config.cpu_threads_intra = args.threads
+    train_config.cpu_threads_inter = args.interop_threads
+    train_config.cpu_autocast_bf16 = args.bf16
     iter_count = 5
     do_iteration_and_log("default", train_config, False, iter_count)
 
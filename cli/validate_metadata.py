@@ -2,15 +2,14 @@
 # https://www.gnu.org/licenses/gpl-3.0.en.html
 # SPDX-License-Identifier: GPL-3.0-only
 
-import json
 import sys
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
 
-import torch
-
 from toan.model.metadata import ModelA2Metadata
 from toan.model.nam_a2_wavenet_config import json_a2_wavenet_container_config
 from toan.model.nam_a2_wavenet_torch import NamA2WaveNetTorch
+from toan.persistence.nam_file import load_nam_json
+from toan.training.device_torch import TorchDeviceType, get_torch_device
 
 # Loudness is in dB and gain is a 0..1 ratio; these are written to json as
 # 32-bit floats, so allow a small tolerance when comparing.
@@ -42,11 +41,17 @@ def main() -> int:
         formatter_class=ArgumentDefaultsHelpFormatter,
     )
     arg_parser.add_argument("nam_path", type=str, help="Path to an A2 .nam file")
+    arg_parser.add_argument(
+        "--device",
+        type=str,
+        default=TorchDeviceType.Auto.get_label(),
+        choices=[device_type.get_label() for device_type in TorchDeviceType],
+        help="Torch device used to recompute the metadata",
+    )
     args = arg_parser.parse_args()
 
     print("Loading nam file...")
-    with open(args.nam_path) as file:
-        root = json.load(file)
+    root = load_nam_json(args.nam_path)
 
     architecture = root.get("architecture")
     if architecture != "SlimmableContainer":
@@ -68,7 +73,7 @@ def main() -> int:
     submodel_weights = [entry["model"]["weights"] for entry in submodel_entries]
     model.import_nam_linear_weights(submodel_weights)
 
-    device = torch.device("mps")
+    device = get_torch_device(TorchDeviceType.from_label(args.device))
     model.to(device)
 
     print("Recomputing loudness and gain...")
@@ -11,12 +11,12 @@ from toan.gui.playback import PlaybackWizard
 from toan.gui.record import RecordWizard
 from toan.gui.sound_manager import SoundManager
 from toan.gui.train import TrainingWizard
-from toan.signal.capture_signal import generate_capture_signal
+from toan.persistence.capture_signal_cache import get_capture_signal_cached
 
 
 def _clicked_play_training_signal():
     playback_sample_rate = 48000
-    signal = generate_capture_signal(playback_sample_rate).signal
+    signal = get_capture_signal_cached(playback_sample_rate).signal
     sd.play(signal, playback_sample_rate)
 
 
@@ -24,7 +24,7 @@ def _clicked_save_training_signal():
     file_path, _ = QtWidgets.QFileDialog.getSaveFileName(filter="Wav Files (*.wav)")
     if file_path == "":
         return
-    signal = generate_capture_signal(48000).signal
+    signal = get_capture_signal_cached(48000).signal
     scipy.io.wavfile.write(file_path, 48000, signal.astype(np.float32))
 
 
@@ -4,17 +4,21 @@
 
 import numpy as np
 import sounddevice as sd
-import torch
-from PySide6 import QtWidgets
+from PySide6 import QtCore, QtWidgets
 
 from toan.gui.playback import PlaybackContext
-from toan.model.nam_a2_wavenet_torch import NamA2WaveNetTorch
+from toan.model.nam_a2_wavenet_render_torch import render_nam_a2
+from toan.model.nam_a2_wavenet_stream_torch import NamA2WaveNetStreamTorch
 from toan.soundio import SdChannel, generate_descriptions, get_input_devices
+from toan.soundio.monitor import MonitorController
 
 LISTEN_TEXT = [
     "This page allows you to asynchronously record a signal, then listen to how the model responds to that signal.",
+    "You can also monitor the model live, the selected input is processed block by block and sent to the default output device.",
 ]
 
+MONITOR_BLOCK_SIZE = 256
+
 
 class PlaybackListenPage(QtWidgets.QWizardPage):
     context: PlaybackContext
@@ -31,10 +35,21 @@ class PlaybackListenPage(QtWidgets.QWizardPage):
 
     wet_signal: np.ndarray | None = None
 
+    monitor_button: QtWidgets.QPushButton
+    monitor_latency_label: QtWidgets.QLabel
+    monitor_timer: QtCore.QTimer
+
+    monitor_engine: NamA2WaveNetStreamTorch | None = None
+    monitor_controller: MonitorController | None = None
+
     def __init__(self, parent, context: PlaybackContext):
         super().__init__(parent)
         self.context = context
 
+        self.monitor_timer = QtCore.QTimer(self)
+        self.monitor_timer.setInterval(250)
+        self.monitor_timer.timeout.connect(self._monitor_timer_triggered)
+
         self.setTitle("Listen")
         layout = QtWidgets.QVBoxLayout(self)
 
@@ -77,8 +92,21 @@ class PlaybackListenPage(QtWidgets.QWizardPage):
         self.stop_button.clicked.connect(self._clicked_stop)
         play_group_layout.addWidget(self.stop_button)
 
+        self.monitor_group = QtWidgets.QGroupBox("Live Monitor", self)
+        monitor_group_layout = QtWidgets.QFormLayout(self.monitor_group)
+
+        self.monitor_latency_label = QtWidgets.QLabel("-", self.monitor_group)
+        monitor_group_layout.addRow("Block Time:", self.monitor_latency_label)
+
+        self.monitor_button = QtWidgets.QPushButton(
+            "Start Monitoring", self.monitor_group
+        )
+        self.monitor_button.clicked.connect(self._clicked_monitor)
+        monitor_group_layout.addRow("", self.monitor_button)
+
         layout.addWidget(self.record_group)
         layout.addWidget(self.play_group)
+        layout.addWidget(self.monitor_group)
 
     def cleanupPage(self):
         self._stop_all()
@@ -90,7 +118,10 @@ class PlaybackListenPage(QtWidgets.QWizardPage):
     def _clicked_play(self):
         if self.wet_signal is None or len(self.wet_signal) == 0:
             return
-        signal = _convert_complete_signal(self.wet_signal, self.context.nam_model)
+        # Padded with silence so a take shorter than the receptive field still plays
+        signal = render_nam_a2(
+            self.context.nam_model, self.wet_signal, pad_history=True
+        )
         sd.play(signal, self.context.sample_rate)
 
     def _clicked_record(self):
@@ -115,26 +146,57 @@ class PlaybackListenPage(QtWidgets.QWizardPage):
             self.record_active = False
             self.record_button.setText("Start Recording")
 
+    def _clicked_monitor(self):
+        if self.monitor_controller is None:
+            desc = self.indev_combo.currentText()
+            if desc not in self.indev_desc_map:
+                return
+            self.monitor_engine = NamA2WaveNetStreamTorch(
+                self.context.nam_model, max_block_size=MONITOR_BLOCK_SIZE
+            )
+            self.monitor_controller = MonitorController(
+                self.context.sample_rate,
+                self.indev_desc_map[desc],
+                MONITOR_BLOCK_SIZE,
+                self.monitor_engine.process_block,
+            )
+            self.monitor_controller.start()
+            self.monitor_timer.start()
+            self.monitor_button.setText("Stop Monitoring")
+        else:
+            self._stop_monitor()
+
     def _clicked_stop(self):
         self._stop_all()
 
     def _stop_all(self):
         if self.record_active:
             self.record_stream.stop()
+        self._stop_monitor()
         sd.stop()
 
+    def _stop_monitor(self):
+        if self.monitor_controller is not None:
+            self.monitor_controller.close()
+            self.monitor_controller = None
+        self.monitor_timer.stop()
+        self.monitor_button.setText("Start Monitoring")
+
+    def _monitor_timer_triggered(self):
+        if self.monitor_engine is None or self.monitor_controller is None:
+            return
+        latency = self.monitor_engine.latency
+        block_budget = MONITOR_BLOCK_SIZE / self.context.sample_rate
+        self.monitor_latency_label.setText(
+            f"{latency.mean_seconds() * 1000:.2f} ms mean, "
+            f"{latency.max_seconds * 1000:.2f} ms max, "
+            f"{block_budget * 1000:.2f} ms available, "
+            f"{self.monitor_controller.dropouts} dropouts"
+        )
+
     def _record_input_callback(
         self, indata: np.ndarray, frames: int, time, status: sd.CallbackFlags
     ) -> None:
         self.recorded_samples.append(
             indata[:, self.record_channel.channel_index - 1].copy()
         )
-
-
-def _convert_complete_signal(
-    raw_signal: np.ndarray, model: NamA2WaveNetTorch
-) -> np.ndarray:
-    x = torch.tensor(raw_signal).reshape(1, -1)
-    with torch.no_grad():
-        output = model.forward_best(x)
-    return np.array(output.squeeze())
@@ -4,12 +4,14 @@
 
 import json
 
+import numpy as np
 from PySide6 import QtGui, QtWidgets
 
 from toan.gui.playback import PlaybackContext
 from toan.model.metadata import ModelA2Metadata
 from toan.model.nam_a2_wavenet_config import json_a2_wavenet_container_config
 from toan.model.nam_a2_wavenet_torch import NamA2WaveNetTorch
+from toan.persistence.nam_file import load_nam_json
 
 
 class PlaybackValidatePage(QtWidgets.QWizardPage):
@@ -37,9 +39,8 @@ class PlaybackValidatePage(QtWidgets.QWizardPage):
         self.text_edit.append(f"Analyzing NAM file: {self.context.nam_model_path}")
 
         try:
-            with open(self.context.nam_model_path, "r") as file:
-                nam_json = json.load(file)
-                self.text_edit.append("Parsed file")
+            nam_json = load_nam_json(self.context.nam_model_path)
+            self.text_edit.append("Parsed file")
         except FileNotFoundError:
             self.text_edit.append("Error: Failed to open file")
             return
@@ -107,18 +108,20 @@ class PlaybackValidatePage(QtWidgets.QWizardPage):
         self.text_edit.append(f"Model parameters: {model.parameter_count}")
         self.text_edit.append(f"Submodels: {len(model.submodels)}")
 
-        submodel_weights: list[list[float]] = []
+        submodel_weights: list[np.ndarray] = []
         for submodel in nam_json["config"]["submodels"]:
             if (
                 not isinstance(submodel, dict)
                 or "model" not in submodel
                 or not isinstance(submodel["model"], dict)
                 or "weights" not in submodel["model"]
-                or not isinstance(submodel["model"]["weights"], list)
+                or not isinstance(submodel["model"]["weights"], (list, np.ndarray))
             ):
                 self.text_edit.append("Error: Submodel weights are not specified")
                 return
-            submodel_weights.append(submodel["model"]["weights"])
+            submodel_weights.append(
+                np.asarray(submodel["model"]["weights"], dtype=np.float32)
+            )
 
         weight_count = sum(len(weights) for weights in submodel_weights)
         self.text_edit.append(f"Profile parameters: {weight_count}")
@@ -12,6 +12,7 @@ from toan.gui.record import RecordingContext
 from toan.signal.generator.chirp import generate_chirp
 from toan.signal.mix import concat_signals
 from toan.soundio import SdIoController
+from toan.soundio.meter import LevelMeter
 
 VOLUME_TEXT = [
     "In this section you will set the input gain on your interface. You want the audio signal to be captured as loudly as possible without clipping.",
@@ -37,7 +38,7 @@ class RecordInputGainPage(QtWidgets.QWizardPage):
     label_gain_feedback: QtWidgets.QLabel
 
     io_controller: SdIoController | None = None
-    volume_samples: np.ndarray
+    level_meter: LevelMeter
 
     def __init__(self, parent, context: RecordingContext):
         super().__init__(parent)
@@ -46,7 +47,7 @@ class RecordInputGainPage(QtWidgets.QWizardPage):
         single_sweep = generate_chirp(context.sample_rate, 18, 22000, 0.90)
         single_sweep_samples = len(single_sweep)
         volume_buffer_samples = math.floor(single_sweep_samples * 1.05)
-        self.volume_samples = np.zeros(volume_buffer_samples)
+        self.level_meter = LevelMeter(volume_buffer_samples)
 
         self.output_callback_signal = concat_signals([single_sweep] * 30, 0)
 
@@ -110,6 +111,7 @@ class RecordInputGainPage(QtWidgets.QWizardPage):
             return
         self.play_active = True
         self.play_button.setText("Stop Test Sound")
+        self.level_meter.reset()
         self.bar_update_timer.start()
         self._setup_io_streams()
 
@@ -124,6 +126,9 @@ class RecordInputGainPage(QtWidgets.QWizardPage):
         self.io_controller.start()
 
     def _update_status(self):
+        if self.play_active:
+            peak = self.level_meter.peak()
+            self.bar_progress = min(BAR_PRECISION, math.floor(peak * 1000))
         self.bar_input_level.setValue(self.bar_progress)
         volume = self.bar_progress / 10
         self.text_volume.setText(f"{volume}")
@@ -141,15 +146,9 @@ class RecordInputGainPage(QtWidgets.QWizardPage):
     def _input_callback(
         self, indata: np.ndarray, frames: int, time, status: sd.CallbackFlags
     ) -> None:
-        buffer_length = len(self.volume_samples)
-        self.volume_samples = np.concat(
-            (
-                self.volume_samples,
-                indata[:, self.context.input_channel.channel_index - 1],
-            )
-        )[-buffer_length:]
-        out_val = self.volume_samples.max()
-        self.bar_progress = min(BAR_PRECISION, math.floor(out_val * 1000))
+        self.level_meter.process_block(
+            indata[:, self.context.input_channel.channel_index - 1]
+        )
 
     def _output_callback(
         self, outdata: np.ndarray, frames: int, time, status: sd.CallbackFlags
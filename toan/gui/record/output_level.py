@@ -10,6 +10,7 @@ from toan.gui.record import RecordingContext
 from toan.music import get_note_frequency_by_name
 from toan.signal.generator.pluck import generate_generic_chord_pluck
 from toan.soundio import SdChannel, SdDevice, generate_descriptions, get_output_devices
+from toan.soundio.meter import LevelMeter
 from toan.soundio.record_wet import RecordWetController, RecordWetProgress
 
 OUTPUT_LEVEL_TEXT = [
@@ -27,6 +28,7 @@ class RecordOutputLevelPage(QtWidgets.QWizardPage):
     button_record: QtWidgets.QPushButton
     button_play: QtWidgets.QPushButton
     progress_bar: QtWidgets.QProgressBar
+    label_level: QtWidgets.QLabel
 
     combo_playback_channel: QtWidgets.QComboBox
     combo_playback_map: dict[str, SdChannel]
@@ -38,6 +40,8 @@ class RecordOutputLevelPage(QtWidgets.QWizardPage):
     record_progress: RecordWetProgress | None = None
     recorded_buffer: np.ndarray | None = None
     recorded_playback_index: int = 0
+    level_meter: LevelMeter | None = None
+    recorded_peak: float = 0.0
 
     play_controller: sd.OutputStream | None = None
 
@@ -69,6 +73,9 @@ class RecordOutputLevelPage(QtWidgets.QWizardPage):
         self.progress_bar = QtWidgets.QProgressBar(self)
         layout.addWidget(self.progress_bar)
 
+        self.label_level = QtWidgets.QLabel("", self)
+        layout.addWidget(self.label_level)
+
         hline2 = QtWidgets.QFrame(self)
         hline2.setFrameShape(QtWidgets.QFrame.Shape.HLine)
         hline2.setFrameShadow(QtWidgets.QFrame.Shadow.Sunken)
@@ -154,11 +161,15 @@ class RecordOutputLevelPage(QtWidgets.QWizardPage):
                 * 0.99
             )
 
+        # The window outlasts the refresh interval so no peak is missed
+        self.level_meter = LevelMeter(self.context.sample_rate // 2)
+        self.recorded_peak = 0.0
         self.record_controller = RecordWetController(
             self.context.sample_rate,
             self.generated_chords,
             self.context.input_channel,
             self.context.output_channel,
+            self.level_meter,
         )
         self.record_progress = self.record_controller.progress
         self.record_controller.start()
@@ -183,6 +194,13 @@ class RecordOutputLevelPage(QtWidgets.QWizardPage):
             if self.record_progress is not None:
                 self.progress_bar.setValue(self.record_progress.samples_played)
 
+        if self.level_meter is not None:
+            self.recorded_peak = max(self.recorded_peak, self.level_meter.peak())
+            level_text = f"Peak: {self.recorded_peak * 100:.1f}"
+            if self.level_meter.clip_count > 0:
+                level_text += f", clipped samples: {self.level_meter.clip_count}"
+            self.label_level.setText(level_text)
+
         if self.record_controller is not None and self.record_controller.is_complete():
             # Recording has ended, kill the stream
             self.record_controller.close()
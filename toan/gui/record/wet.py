@@ -2,10 +2,11 @@
 # https://www.gnu.org/licenses/gpl-3.0.en.html
 # SPDX-License-Identifier: GPL-3.0-only
 
+
 from PySide6 import QtCore, QtWidgets
 
 from toan.gui.record import RecordingContext
-from toan.signal.capture_signal import generate_capture_signal
+from toan.persistence.capture_signal_cache import get_capture_signal_cached
 from toan.signal.mix import concat_signals
 from toan.soundio.record_wet import RecordWetController, RecordWetProgress
 
@@ -70,7 +71,7 @@ class RecordWetSignalPage(QtWidgets.QWizardPage):
     def _clicked_record(self):
         self.button_record.setEnabled(False)
 
-        capture_signal_details = generate_capture_signal(self.context.sample_rate)
+        capture_signal_details = get_capture_signal_cached(self.context.sample_rate)
         self.context.segment_dry_clicks = capture_signal_details.segment_clicks
         self.context.segment_dry_sweep = capture_signal_details.segment_sweep
 
@@ -4,12 +4,11 @@
 
 from typing import Callable
 
-import numpy as np
-import torch
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
 from PySide6 import QtWidgets
 
 from toan.gui.train import TrainingGuiContext
+from toan.model.nam_a2_wavenet_render_torch import render_nam_a2
 from toan.model.nam_a2_wavenet_torch import NamA2WaveNetTorch
 from toan.signal.analysis import generate_spectrogram
 
@@ -63,7 +62,7 @@ class TrainGraphPage(QtWidgets.QWizardPage):
             return False
 
         with open(file_path, "w") as file:
-            file.write(self.context.progress_context.model.export_nam_json_str())
+            self.context.progress_context.model.export_nam_json(file)
 
         return True
 
@@ -113,17 +112,9 @@ class TrainGraphPage(QtWidgets.QWizardPage):
     ) -> None:
         the_model = self.context.progress_context.model
         assert the_model is not None
-        input = np.concat(
-            [np.zeros(the_model.receptive_field - 1), self.context.signal_dry_sweep]
+        output = render_nam_a2(
+            the_model, self.context.signal_dry_sweep, sub_index, pad_history=True
         )
-        input = torch.tensor(input.astype(np.float32)).to(torch.device("mps"))
-
-        with torch.no_grad():
-            if sub_index is None:
-                output = the_model(input.reshape(1, -1))
-            else:
-                output = the_model.submodels[sub_index](input.reshape(1, -1))
-        output = output.squeeze().cpu().detach().numpy()
 
         canvas.figure = generate_spectrogram(self.context.sample_rate, output)
         canvas.draw_idle()
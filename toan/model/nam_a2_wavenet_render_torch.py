@@ -0,0 +1,104 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable
+
+import numpy as np
+import torch
+
+from toan.model.nam_a2_wavenet_torch import NamA2WaveNetTorch
+
+DEFAULT_RENDER_CHUNK_SIZE = 65536
+
+
+def forward_chunked(
+    forward: Callable[[torch.Tensor], torch.Tensor],
+    x: torch.Tensor,
+    receptive_field: int,
+    chunk_size: int,
+) -> torch.Tensor:
+    # Evaluate a long input in pieces that each carry receptive_field - 1 samples
+    # of history, the concatenated output matches a single forward pass
+    overlap = receptive_field - 1
+    out_length = x.shape[-1] - overlap
+    if chunk_size <= 0 or out_length <= chunk_size:
+        return forward(x)
+    outputs = []
+    for begin in range(0, out_length, chunk_size):
+        end = min(begin + chunk_size, out_length)
+        outputs.append(forward(x[..., begin : end + overlap]))
+    return torch.cat(outputs, dim=-1)
+
+
+def render_chunked(
+    forward: Callable[[torch.Tensor], torch.Tensor],
+    signal: np.ndarray,
+    receptive_field: int,
+    chunk_size: int = DEFAULT_RENDER_CHUNK_SIZE,
+    threads: int = 0,
+    device: torch.device | None = None,
+) -> np.ndarray:
+    # Output has len(signal) - (receptive_field - 1) samples like a single forward
+    # pass, but only one chunk of activations per thread exists at any time. A
+    # signal shorter than the receptive field gives an empty output
+    assert chunk_size > 0
+    overlap = receptive_field - 1
+    out_length = len(signal) - overlap
+    if out_length <= 0:
+        return np.zeros(0, dtype=np.float32)
+    signal = np.ascontiguousarray(signal, dtype=np.float32)
+    result = np.empty(out_length, dtype=np.float32)
+
+    def render_chunk(begin: int) -> None:
+        end = min(begin + chunk_size, out_length)
+        x = torch.from_numpy(signal[begin : end + overlap]).to(device)
+        with torch.inference_mode():
+            y = forward(x.reshape((1, -1)))
+        result[begin:end] = y.reshape(-1).cpu().numpy()
+
+    begin_points = range(0, out_length, chunk_size)
+    if threads <= 1 or len(begin_points) == 1:
+        for begin in begin_points:
+            render_chunk(begin)
+        return result
+
+    # Chunks only share the input, keep a bounded number in flight
+    with ThreadPoolExecutor(threads) as executor:
+        pending = set()
+        for begin in begin_points:
+            if len(pending) >= threads * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(executor.submit(render_chunk, begin))
+        for future in pending:
+            future.result()
+    return result
+
+
+def render_nam_a2(
+    model: NamA2WaveNetTorch,
+    signal: np.ndarray,
+    submodel_index: int | None = None,
+    chunk_size: int = DEFAULT_RENDER_CHUNK_SIZE,
+    threads: int = 0,
+    pad_history: bool = False,
+) -> np.ndarray:
+    # With pad_history the input is preceded by silence and the output has the
+    # same length as the input
+    if submodel_index is None:
+        submodel_index = model.best_submodel_index()
+    if pad_history:
+        signal = np.concatenate(
+            [np.zeros(model.receptive_field - 1, dtype=np.float32), signal]
+        )
+    return render_chunked(
+        model.submodels[submodel_index],
+        signal,
+        model.receptive_field,
+        chunk_size,
+        threads,
+        next(model.parameters()).device,
+    )
@@ -0,0 +1,159 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import torch
+from torch import nn
+
+from toan.model.nam_a2_wavenet_torch import NamA2WaveNetTorch
+
+
+@dataclass
+class StreamLatencyStats:
+    blocks: int = 0
+    samples: int = 0
+    total_seconds: float = 0.0
+    last_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def mean_seconds(self) -> float:
+        if self.blocks == 0:
+            return 0.0
+        return self.total_seconds / self.blocks
+
+
+class _StreamingConv1d:
+    conv: nn.Conv1d
+    history: int
+
+    # Two buffers of [history | block], the tail of one is copied to the head of
+    # the other after each block so no history is ever recomputed
+    buffers: list[torch.Tensor]
+    active: int
+
+    def __init__(self, conv: nn.Conv1d, max_block_size: int):
+        self.conv = conv
+        self.history = (conv.kernel_size[0] - 1) * conv.dilation[0]
+        shape = (1, conv.in_channels, self.history + max_block_size)
+        self.buffers = [
+            torch.zeros(shape, dtype=conv.weight.dtype, device=conv.weight.device)
+            for _ in range(2)
+        ]
+        self.active = 0
+
+    def reset(self) -> None:
+        for buffer in self.buffers:
+            buffer.zero_()
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        if self.history == 0:
+            return self.conv(x)
+        block_size = x.shape[2]
+        buffer = self.buffers[self.active]
+        buffer[:, :, self.history : self.history + block_size] = x
+        result = self.conv(buffer[:, :, : self.history + block_size])
+        next_buffer = self.buffers[1 - self.active]
+        next_buffer[:, :, : self.history] = buffer[
+            :, :, block_size : block_size + self.history
+        ]
+        self.active = 1 - self.active
+        return result
+
+
+class NamA2WaveNetStreamTorch:
+    model: NamA2WaveNetTorch
+    submodel_index: int
+    max_block_size: int
+    latency: StreamLatencyStats
+
+    # After reset the engine behaves as if it had been fed silence forever, so the
+    # output matches a full-buffer forward of the input with receptive_field - 1
+    # zeros prepended
+    def __init__(
+        self,
+        model: NamA2WaveNetTorch,
+        submodel_index: int | None = None,
+        max_block_size: int = 512,
+    ):
+        assert max_block_size > 0
+        self.model = model
+        self.submodel_index = (
+            model.best_submodel_index() if submodel_index is None else submodel_index
+        )
+        self.max_block_size = max_block_size
+        self.latency = StreamLatencyStats()
+
+        submodel = model.submodels[self.submodel_index]
+        assert submodel.head is None
+        self._device = next(model.parameters()).device
+        self._groups = []
+        for group in submodel.layer_groups:
+            self._groups.append(
+                (
+                    group,
+                    [
+                        _StreamingConv1d(layer.conv, max_block_size)
+                        for layer in group.layers
+                    ],
+                    _StreamingConv1d(group.head_rechannel, max_block_size),
+                )
+            )
+        self.reset()
+
+    @property
+    def submodel(self) -> nn.Module:
+        return self.model.submodels[self.submodel_index]
+
+    def reset(self) -> None:
+        for _, layer_convs, head_conv in self._groups:
+            for conv in layer_convs:
+                conv.reset()
+            head_conv.reset()
+        # Prime every buffer with the model's response to silence
+        silence_remaining = self.model.receptive_field - 1
+        with torch.inference_mode():
+            while silence_remaining > 0:
+                block_size = min(silence_remaining, self.max_block_size)
+                self._process(torch.zeros((1, 1, block_size), device=self._device))
+                silence_remaining -= block_size
+        self.latency = StreamLatencyStats()
+
+    def _process(self, x: torch.Tensor) -> torch.Tensor:
+        y, head_input = x, None
+        for group, layer_convs, head_conv in self._groups:
+            y = group.rechannel(y)
+            for layer, layer_conv in zip(group.layers, layer_convs):
+                post_activation = layer.activation(layer_conv(y) + layer.input_mixer(x))
+                y = y + layer.layer1x1(post_activation)
+                head_input = (
+                    post_activation
+                    if head_input is None
+                    else head_input + post_activation
+                )
+            head_input = head_conv(head_input)
+        return self.submodel.config.head_scale * head_input
+
+    def process_block(self, block: np.ndarray) -> np.ndarray:
+        assert block.ndim == 1
+        time_begin = time.perf_counter()
+        result = np.empty(len(block), dtype=np.float32)
+        with torch.inference_mode():
+            for begin in range(0, len(block), self.max_block_size):
+                end = min(begin + self.max_block_size, len(block))
+                x = torch.from_numpy(
+                    np.ascontiguousarray(block[begin:end], dtype=np.float32)
+                ).to(self._device)
+                y = self._process(x.reshape((1, 1, -1)))
+                result[begin:end] = y.reshape(-1).cpu().numpy()
+        elapsed = time.perf_counter() - time_begin
+
+        self.latency.blocks += 1
+        self.latency.samples += len(block)
+        self.latency.total_seconds += elapsed
+        self.latency.last_seconds = elapsed
+        self.latency.max_seconds = max(self.latency.max_seconds, elapsed)
+        return result
@@ -2,12 +2,14 @@
 # https://www.gnu.org/licenses/gpl-3.0.en.html
 # SPDX-License-Identifier: GPL-3.0-only
 
-import json
+import io
 import math
 from pathlib import Path
+from typing import TextIO
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 from torch import nn
 
 from toan.model.metadata import ModelA2Metadata, SubmodelA2Metadata
@@ -16,17 +18,38 @@ from toan.model.nam_a2_wavenet_config import (
     NamA2WaveNetContainerConfig,
     NamA2WaveNetLayerGroupConfig,
 )
+from toan.model.nam_json import write_json_stream
 from toan.wav import load_and_resample_wav
 
 # Based on code from Neural Amp Modeler
 # https://github.com/sdatkinson/neural-amp-modeler/tree/2de335b3ee1138529286117978a54fc16aeb313c/nam/models/wavenet
 
 
+# Input gains used to measure how much a model compresses its output
+_METADATA_GAIN_STEPS = np.linspace(0.0, 1.0, 11)
+
+# Decoded and resampled loudness probes keyed by sample rate
+_loudness_probe_cache: dict[int, np.ndarray] = {}
+
+
 def _load_loudness_probe_signal(sample_rate: int) -> np.ndarray:
-    script_dir = Path(__file__).resolve().parent
-    root_dir = script_dir.parent.parent
-    probe_path = root_dir.joinpath("data").joinpath("nam_loudness.flac").resolve()
-    return load_and_resample_wav(sample_rate, str(probe_path))
+    probe = _loudness_probe_cache.get(sample_rate)
+    if probe is None:
+        script_dir = Path(__file__).resolve().parent
+        root_dir = script_dir.parent.parent
+        probe_path = root_dir.joinpath("data").joinpath("nam_loudness.flac").resolve()
+        probe = load_and_resample_wav(sample_rate, str(probe_path))
+        _loudness_probe_cache[sample_rate] = probe
+    return probe
+
+
+def _normalized_gain_from_loudness(loudness: np.ndarray) -> float:
+    max_gain = loudness[-1] * len(loudness)  # "Square" (no compression)
+    min_gain = 0.5 * max_gain  # "Triangle" (full compression)
+    gain_range = max_gain - min_gain
+    this_gain = loudness.sum()
+    normalized_gain = (this_gain - min_gain) / gain_range
+    return float(np.clip(normalized_gain, 0.0, 1.0))
 
 
 def _reset_conv_from_generator(conv: nn.Conv1d, generator: torch.Generator) -> None:
@@ -44,12 +67,12 @@ def _build_activation_module_a2(activation: str, negative_slope: float) -> nn.Mo
 
 
 class _NamA2Conv1dLayerTorch(nn.Conv1d):
-    def export_nam_linear_weights(self) -> list[float]:
+    def export_nam_weight_tensors(self) -> list[torch.Tensor]:
         result = []
         if self.weight is not None:
-            result.extend(self.weight.detach().flatten().tolist())
+            result.append(self.weight.detach().flatten())
         if self.bias is not None:
-            result.extend(self.bias.detach().flatten().tolist())
+            result.append(self.bias.detach().flatten())
         return result
 
     def import_nam_linear_weights(self, weights: torch.Tensor, i: int) -> int:
@@ -103,11 +126,11 @@ class _NamA2WaveNetLayerTorch(nn.Module):
             post_activation[:, :, -out_length:],
         )
 
-    def export_nam_linear_weights(self) -> list[float]:
+    def export_nam_weight_tensors(self) -> list[torch.Tensor]:
         result = []
-        result.extend(self.conv.export_nam_linear_weights())
-        result.extend(self.input_mixer.export_nam_linear_weights())
-        result.extend(self.layer1x1.export_nam_linear_weights())
+        result.extend(self.conv.export_nam_weight_tensors())
+        result.extend(self.input_mixer.export_nam_weight_tensors())
+        result.extend(self.layer1x1.export_nam_weight_tensors())
         return result
 
     def import_nam_linear_weights(self, weights: torch.Tensor, i: int) -> int:
@@ -165,12 +188,12 @@ class _NamA2WaveNetLayerGroupTorch(nn.Module):
             )
         return self.head_rechannel(head_input), x[:, :, -out_length:]
 
-    def export_nam_linear_weights(self) -> list[float]:
+    def export_nam_weight_tensors(self) -> list[torch.Tensor]:
         result = []
-        result.extend(self.rechannel.export_nam_linear_weights())
+        result.extend(self.rechannel.export_nam_weight_tensors())
         for layer in self.layers:
-            result.extend(layer.export_nam_linear_weights())
-        result.extend(self.head_rechannel.export_nam_linear_weights())
+            result.extend(layer.export_nam_weight_tensors())
+        result.extend(self.head_rechannel.export_nam_weight_tensors())
         return result
 
     def import_nam_linear_weights(self, weights: torch.Tensor, i: int) -> int:
@@ -228,36 +251,185 @@ class _NamA2WaveNetSubmodelTorch(nn.Module):
             loudness = 20.0 * torch.log10(loudness)
         return loudness.item()
 
+    def metadata_loudness_batch(
+        self, probe: torch.Tensor, gains: np.ndarray
+    ) -> np.ndarray:
+        # Every gain is applied to the probe in a single batched forward pass
+        gains_t = torch.from_numpy(gains).to(dtype=probe.dtype, device=probe.device)
+        with torch.no_grad():
+            y = self(gains_t[:, None] * probe.reshape((1, -1)))
+        loudness = torch.sqrt(torch.mean(torch.square(y), dim=-1))
+        return loudness.cpu().numpy().astype(np.float64)
+
     def metadata_gain(self, probe: torch.Tensor) -> float:
-        x = np.linspace(0.0, 1.0, 11)
-        y = np.array([self.metadata_loudness(probe, gain=g, db=False) for g in x])
-        max_gain = y[-1] * len(x)  # "Square" (no compression)
-        min_gain = 0.5 * max_gain  # "Triangle" (full compression)
-        gain_range = max_gain - min_gain
-        this_gain = y.sum()
-        normalized_gain = (this_gain - min_gain) / gain_range
-        return float(np.clip(normalized_gain, 0.0, 1.0))
+        loudness = self.metadata_loudness_batch(probe, _METADATA_GAIN_STEPS)
+        return _normalized_gain_from_loudness(loudness)
 
-    def export_nam_linear_weights(self) -> list[float]:
-        result = []
+    def metadata_loudness_and_gain(self, probe: torch.Tensor) -> tuple[float, float]:
+        # The last gain step is 1.0, so the plain loudness comes from the same pass
+        loudness = self.metadata_loudness_batch(probe, _METADATA_GAIN_STEPS)
+        loudness_db = float(20.0 * np.log10(loudness[-1]))
+        return loudness_db, _normalized_gain_from_loudness(loudness)
+
+    def _export_nam_weights_flat(self) -> torch.Tensor:
+        tensors = []
         for group in self.layer_groups:
-            group_weights: list[float] = group.export_nam_linear_weights()
-            result.extend(group_weights)
+            tensors.extend(group.export_nam_weight_tensors())
         assert self.head is None
+        return torch.cat(tensors).cpu()
+
+    def export_nam_linear_weights(self) -> list[float]:
+        result = self._export_nam_weights_flat().tolist()
         result.append(self.config.head_scale)  # head_scale is the trailing scalar
         return result
 
-    def import_nam_linear_weights(self, weights: list[float]) -> int:
+    def export_nam_weights_array(self) -> np.ndarray:
+        # The weights as float32 widened to float64 so head_scale, like the other
+        # config values, is kept at full precision
+        weights = self._export_nam_weights_flat().float().numpy()
+        return np.append(weights.astype(np.float64), self.config.head_scale)
+
+    def import_nam_linear_weights(self, weights: list[float] | np.ndarray) -> int:
         i = 0
-        weights_t = torch.tensor(weights)
+        weights_t = torch.tensor(weights, dtype=torch.float32)
         for group in self.layer_groups:
             i = group.import_nam_linear_weights(weights_t, i)
         if i < weights_t.numel():
-            self.config.head_scale = float(weights_t[i].item())
+            self.config.head_scale = float(weights[i])
             i = i + 1
         return i
 
 
+def _pack_fused_conv(
+    convs: list[_NamA2Conv1dLayerTorch], out_channels: int, in_channels: int
+) -> tuple[torch.Tensor, torch.Tensor | None]:
+    # Each submodel's conv is zero padded to the same width and stacked
+    weights = []
+    biases = []
+    for conv in convs:
+        weights.append(
+            F.pad(
+                conv.weight,
+                (
+                    0,
+                    0,
+                    0,
+                    in_channels - conv.in_channels,
+                    0,
+                    out_channels - conv.out_channels,
+                ),
+            )
+        )
+        if conv.bias is not None:
+            biases.append(F.pad(conv.bias, (0, out_channels - conv.out_channels)))
+    return (
+        torch.cat(weights, dim=0),
+        torch.cat(biases, dim=0) if len(biases) > 0 else None,
+    )
+
+
+def _fused_conv1d(
+    x: torch.Tensor,
+    convs: list[_NamA2Conv1dLayerTorch],
+    out_channels: int,
+    shared_input: bool,
+    in_channels: int = 0,
+    packed_cache: dict | None = None,
+) -> torch.Tensor:
+    # A shared input feeds every submodel while a grouped input gives one group per
+    # submodel. Packing has to be part of the graph when training, without grad the
+    # packed weights are kept until a parameter is moved or updated in place
+    if shared_input:
+        in_channels = convs[0].in_channels
+    if packed_cache is not None and not torch.is_grad_enabled():
+        key = (tuple(id(conv) for conv in convs), out_channels, in_channels)
+        versions = tuple(
+            (param.data_ptr(), param._version)
+            for conv in convs
+            for param in conv.parameters()
+        )
+        cached = packed_cache.get(key)
+        if cached is None or cached[0] != versions:
+            cached = (versions, *_pack_fused_conv(convs, out_channels, in_channels))
+            packed_cache[key] = cached
+        weight, bias = cached[1], cached[2]
+    else:
+        weight, bias = _pack_fused_conv(convs, out_channels, in_channels)
+    return F.conv1d(
+        x,
+        weight,
+        bias,
+        dilation=convs[0].dilation,
+        groups=1 if shared_input else len(convs),
+    )
+
+
+def _fused_layer_group_forward(
+    groups: list["_NamA2WaveNetLayerGroupTorch"],
+    x: torch.Tensor,
+    c: torch.Tensor,
+    head_input: torch.Tensor | None,
+    shared_input: bool,
+    in_channels: int,
+    packed_cache: dict,
+) -> tuple[torch.Tensor, torch.Tensor, int]:
+    # Mirrors _NamA2WaveNetLayerGroupTorch.forward for all submodels at once
+    config = groups[0].config
+    channels = max(group.config.channels for group in groups)
+    bottleneck = max(group.config.bottleneck for group in groups)
+    out_length = x.shape[2] - (config.receptive_field() - 1)
+    out_length_no_head = x.shape[2] - (config.receptive_field_no_head_rechannel() - 1)
+    x = _fused_conv1d(
+        x,
+        [group.rechannel for group in groups],
+        channels,
+        shared_input,
+        in_channels,
+        packed_cache,
+    )
+    for layer_index, layer in enumerate(groups[0].layers):
+        layers = [group.layers[layer_index] for group in groups]
+        zconv = _fused_conv1d(
+            x,
+            [layer.conv for layer in layers],
+            bottleneck,
+            False,
+            channels,
+            packed_cache,
+        )
+        mixin = _fused_conv1d(
+            c,
+            [layer.input_mixer for layer in layers],
+            bottleneck,
+            True,
+            packed_cache=packed_cache,
+        )
+        post_activation = layer.activation(zconv + mixin[:, :, -zconv.shape[2] :])
+        x = x[:, :, -post_activation.shape[2] :] + _fused_conv1d(
+            post_activation,
+            [layer.layer1x1 for layer in layers],
+            channels,
+            False,
+            bottleneck,
+            packed_cache,
+        )
+        head_term = post_activation[:, :, -out_length_no_head:]
+        head_input = (
+            head_term
+            if head_input is None
+            else head_input[:, :, -out_length_no_head:] + head_term
+        )
+    head = _fused_conv1d(
+        head_input,
+        [group.head_rechannel for group in groups],
+        config.head_size,
+        False,
+        bottleneck,
+        packed_cache,
+    )
+    return head, x[:, :, -out_length:], channels
+
+
 class NamA2WaveNetTorch(nn.Module):
     def __init__(
         self,
@@ -282,6 +454,10 @@ class NamA2WaveNetTorch(nn.Module):
             ]
         )
 
+        # Evaluate every submodel in one pass of grouped convolutions, see can_fuse
+        self.fused = False
+        self._fused_packed_weights: dict = {}
+
         generator = torch.Generator(device="cpu").manual_seed(rng_seed)
         for module in self.modules():
             if isinstance(module, _NamA2Conv1dLayerTorch):
@@ -299,9 +475,67 @@ class NamA2WaveNetTorch(nn.Module):
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         # Outputs are stacked like (num_submodels, batch, length)
+        if self.fused:
+            return self._forward_fused(x)
         outputs = [submodel(x) for submodel in self.submodels]
         return torch.stack(outputs, dim=0)
 
+    def can_fuse(self) -> bool:
+        # Submodels can be fused when they only differ in channel widths
+        first = self.submodels[0].config
+        for submodel in self.submodels:
+            config = submodel.config
+            if submodel.head is not None or len(config.layers) != len(first.layers):
+                return False
+            if config.layers[0].input_size != first.layers[0].input_size:
+                return False
+            for layer, first_layer in zip(config.layers, first.layers):
+                # Later layer groups take the previous channels as input, which
+                # may differ and are padded like the channels themselves
+                if (
+                    layer.condition_size != first_layer.condition_size
+                    or layer.head_size != first_layer.head_size
+                    or layer.head_bias != first_layer.head_bias
+                    or layer.head_kernel_size != first_layer.head_kernel_size
+                    or layer.kernel_sizes != first_layer.kernel_sizes
+                    or layer.dilations != first_layer.dilations
+                    or layer.activation != first_layer.activation
+                    or layer.negative_slope != first_layer.negative_slope
+                ):
+                    return False
+            if first.layers[-1].head_size != 1:
+                return False
+            # Later layer groups add the previous head output to their own head terms
+            for prev_layer, layer in zip(config.layers[:-1], config.layers[1:]):
+                if prev_layer.head_size != layer.bottleneck:
+                    return False
+        return True
+
+    def _forward_fused(self, x: torch.Tensor) -> torch.Tensor:
+        if x.ndim == 2:
+            x = x[:, None, :]
+        num_submodels = len(self.submodels)
+        y, head_input, in_channels = x, None, 0
+        for group_index in range(len(self.submodels[0].layer_groups)):
+            groups = [submodel.layer_groups[group_index] for submodel in self.submodels]
+            head_input, y, in_channels = _fused_layer_group_forward(
+                groups,
+                y,
+                x,
+                head_input,
+                group_index == 0,
+                in_channels,
+                self._fused_packed_weights,
+            )
+        head_scale = torch.tensor(
+            [submodel.config.head_scale for submodel in self.submodels],
+            dtype=head_input.dtype,
+            device=head_input.device,
+        )
+        result = head_input * head_scale[None, :, None]
+        assert result.shape[1] == num_submodels
+        return result.permute(1, 0, 2)
+
     def best_submodel_index(self) -> int:
         best = 0
         for index in range(len(self.max_values)):
@@ -327,8 +561,9 @@ class NamA2WaveNetTorch(nn.Module):
             for submodel, submodel_metadata in zip(
                 self.submodels, self.submodel_metadata
             ):
-                submodel_metadata.loudness = submodel.metadata_loudness(probe)
-                submodel_metadata.gain = submodel.metadata_gain(probe)
+                loudness, gain = submodel.metadata_loudness_and_gain(probe)
+                submodel_metadata.loudness = loudness
+                submodel_metadata.gain = gain
         finally:
             self.train(was_training)
 
@@ -346,11 +581,12 @@ class NamA2WaveNetTorch(nn.Module):
             "metadata": metadata.export_dict(),
             "architecture": "WaveNet",
             "config": submodel.config.export_dict(),
-            "weights": submodel.export_nam_linear_weights(),
+            "weights": submodel.export_nam_weights_array(),
             "sample_rate": self.sample_rate,
         }
 
-    def export_nam_json_str(self) -> str:
+    def export_nam_json(self, file: TextIO) -> None:
+        # Streams the model to file, weights are formatted as they are written
         metadata_dict = self.metadata.export_dict()
         submodel_entries = []
         for max_value, submodel, submodel_metadata in zip(
@@ -371,9 +607,16 @@ class NamA2WaveNetTorch(nn.Module):
             # This sample rate has to be a float, the others are ints
             "sample_rate": float(self.sample_rate),
         }
-        return json.dumps(root)
+        write_json_stream(file, root)
+
+    def export_nam_json_str(self) -> str:
+        buffer = io.StringIO()
+        self.export_nam_json(buffer)
+        return buffer.getvalue()
 
-    def import_nam_linear_weights(self, submodel_weights: list[list[float]]) -> None:
+    def import_nam_linear_weights(
+        self, submodel_weights: list[list[float] | np.ndarray]
+    ) -> None:
         assert len(submodel_weights) == len(self.submodels)
         for submodel, weights in zip(self.submodels, submodel_weights):
             submodel.import_nam_linear_weights(weights)
@@ -0,0 +1,64 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import json
+from typing import TextIO
+
+import numpy as np
+
+# Weights are formatted and written this many at a time
+_FLOAT_CHUNK_SIZE = 65536
+
+
+def _write_float_array(file: TextIO, values: np.ndarray) -> None:
+    # numpy formats float32 with the shortest repr that reads back to the same
+    # value, non-finite values are spelled the way json.dumps does. A float64
+    # array is written the same way except values float32 can't hold exactly,
+    # which keep their full double repr
+    if values.dtype != np.float64:
+        values = values.astype(np.float32, copy=False)
+    values = values.reshape(-1)
+    file.write("[")
+    for begin in range(0, len(values), _FLOAT_CHUNK_SIZE):
+        chunk = values[begin : begin + _FLOAT_CHUNK_SIZE]
+        narrow = chunk.astype(np.float32)
+        strings = narrow.astype(str)
+        finite = np.isfinite(chunk)
+        wide = finite & (narrow != chunk)
+        if not np.all(finite) or np.any(wide):
+            # Object strings so longer replacements aren't cut to the array width
+            strings = strings.astype(object)
+            strings[wide] = chunk[wide].astype(str)
+            strings[np.isnan(chunk)] = "NaN"
+            strings[chunk == np.inf] = "Infinity"
+            strings[chunk == -np.inf] = "-Infinity"
+        if begin > 0:
+            file.write(", ")
+        file.write(", ".join(strings.tolist()))
+    file.write("]")
+
+
+def write_json_stream(file: TextIO, value) -> None:
+    # Writes value like json.dumps would, except float arrays which are written
+    # in chunks as they are formatted
+    if isinstance(value, np.ndarray):
+        _write_float_array(file, value)
+    elif isinstance(value, dict):
+        file.write("{")
+        for i, (key, item) in enumerate(value.items()):
+            if i > 0:
+                file.write(", ")
+            file.write(json.dumps(key))
+            file.write(": ")
+            write_json_stream(file, item)
+        file.write("}")
+    elif isinstance(value, (list, tuple)):
+        file.write("[")
+        for i, item in enumerate(value):
+            if i > 0:
+                file.write(", ")
+            write_json_stream(file, item)
+        file.write("]")
+    else:
+        file.write(json.dumps(value))
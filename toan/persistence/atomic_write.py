@@ -0,0 +1,22 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import os
+from typing import BinaryIO, Callable
+
+
+def write_file_atomic(path: str, write: Callable[[BinaryIO], None]) -> None:
+    # Writes through a temporary file next to path that is then moved over it, so
+    # other readers see either the old file or the complete new one
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as out_file:
+            write(out_file)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
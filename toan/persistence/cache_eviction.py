@@ -0,0 +1,57 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import os
+
+
+def touch_cache_entry(path: str) -> None:
+    # Marks an entry as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _get_entry_key(path: str) -> str:
+    return os.path.basename(path).split(".", 1)[0]
+
+
+def evict_cache_entries(cache_dir: str, max_bytes: int, keep_path: str) -> None:
+    # Removes the least recently used entries until the cache fits in max_bytes,
+    # an entry is every file named key.extension and is as recent as its newest
+    # file, the entry of keep_path and files still being written are left alone
+    keep_key = _get_entry_key(keep_path)
+    entries: dict[str, tuple[float, int, list[str]]] = {}
+    total_size = 0
+    try:
+        dir_entries = list(os.scandir(cache_dir))
+    except OSError:
+        return
+    for entry in dir_entries:
+        if not entry.is_file() or entry.name.endswith(".tmp"):
+            continue
+        try:
+            entry_stat = entry.stat()
+        except OSError:
+            continue
+        key = _get_entry_key(entry.name)
+        mtime, size, paths = entries.get(key, (0.0, 0, []))
+        paths.append(entry.path)
+        entries[key] = (
+            max(mtime, entry_stat.st_mtime),
+            size + entry_stat.st_size,
+            paths,
+        )
+        total_size += entry_stat.st_size
+    for key, (_, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+        if total_size <= max_bytes:
+            break
+        if key == keep_key:
+            continue
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total_size -= size
@@ -0,0 +1,108 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import dataclasses
+import enum
+import hashlib
+import json
+import os
+
+import numpy as np
+import platformdirs
+
+from toan.persistence.atomic_write import write_file_atomic
+from toan.persistence.cache_eviction import evict_cache_entries, touch_cache_entry
+from toan.signal.capture_signal import (
+    CAPTURE_SIGNAL_VERSION,
+    CaptureSignalConfig,
+    CaptureSignalWithDetails,
+    generate_capture_signal,
+)
+
+# Least recently used signals are removed once the cache grows past this
+CAPTURE_SIGNAL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def get_capture_signal_cache_dir() -> str:
+    root_dir = platformdirs.user_data_dir("toan", "toan")
+    return os.path.join(root_dir, "capture_signal")
+
+
+def _json_default(value):
+    if isinstance(value, enum.Enum):
+        return f"{type(value).__name__}.{value.name}"
+    raise TypeError(f"Cannot hash value of type {type(value).__name__}")
+
+
+def _get_cache_key(sample_rate: int, config: CaptureSignalConfig) -> str:
+    key = json.dumps(
+        {
+            "version": CAPTURE_SIGNAL_VERSION,
+            "sample_rate": sample_rate,
+            "config": dataclasses.asdict(config),
+        },
+        default=_json_default,
+        sort_keys=True,
+    )
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _load_cached(signal_path: str, details_path: str) -> CaptureSignalWithDetails:
+    with open(details_path, "r", encoding="utf-8") as details_file:
+        details = json.load(details_file)
+    signal = np.load(signal_path)
+    return CaptureSignalWithDetails(
+        signal,
+        details["sample_rate"],
+        tuple(details["segment_clicks"]),
+        tuple(details["segment_train"]),
+        tuple(details["segment_sweep"]),
+    )
+
+
+def get_capture_signal_cached(
+    sample_rate: int,
+    config: CaptureSignalConfig = CaptureSignalConfig(),
+    workers: int = 0,
+) -> CaptureSignalWithDetails:
+    # The returned signal is float32 and read into memory rather than mapped, it is
+    # played from audio callbacks that must not wait on the disk
+    cache_dir = get_capture_signal_cache_dir()
+    key = _get_cache_key(sample_rate, config)
+    signal_path = os.path.join(cache_dir, f"{key}.npy")
+    details_path = os.path.join(cache_dir, f"{key}.json")
+    if os.path.isfile(signal_path) and os.path.isfile(details_path):
+        try:
+            result = _load_cached(signal_path, details_path)
+            touch_cache_entry(signal_path)
+            return result
+        except (OSError, ValueError, KeyError):
+            pass
+
+    details = generate_capture_signal(sample_rate, config, workers)
+    details = dataclasses.replace(details, signal=details.signal.astype(np.float32))
+    # The cache only saves time, a failed write still returns the new signal
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # The signal is written last so a present .npy always has its details
+        write_file_atomic(
+            details_path,
+            lambda out_file: out_file.write(
+                json.dumps(
+                    {
+                        "sample_rate": details.sample_rate,
+                        "segment_clicks": details.segment_clicks,
+                        "segment_train": details.segment_train,
+                        "segment_sweep": details.segment_sweep,
+                    }
+                ).encode("utf-8")
+            ),
+        )
+        write_file_atomic(
+            signal_path, lambda out_file: np.save(out_file, details.signal)
+        )
+        evict_cache_entries(cache_dir, CAPTURE_SIGNAL_CACHE_MAX_BYTES, signal_path)
+    except OSError:
+        pass
+    return details
@@ -0,0 +1,203 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import hashlib
+import json
+import os
+import re
+import warnings
+
+import numpy as np
+import platformdirs
+
+from toan.persistence.atomic_write import write_file_atomic
+from toan.persistence.cache_eviction import evict_cache_entries, touch_cache_entry
+
+# Weight arrays are cut out of the document and parsed by numpy, the rest of the
+# document is parsed as json with a marker string where each array was
+_WEIGHTS_PATTERN = re.compile(r'"weights"\s*:\s*\[')
+_WEIGHTS_MARKER_PREFIX = "\u0000toan-weights-"
+
+# Least recently used files are removed once the cache grows past this
+NAM_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def get_nam_cache_dir() -> str:
+    root_dir = platformdirs.user_cache_dir("toan", "toan")
+    return os.path.join(root_dir, "nam")
+
+
+def _parse_weights(text: str) -> np.ndarray | None:
+    if text.strip() == "":
+        return np.zeros(0, dtype=np.float32)
+    # Parsed as double then rounded, the same as reading a json list into torch
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            weights = np.fromstring(text, dtype=np.float64, sep=",")
+        except (ValueError, DeprecationWarning):
+            return None
+    return weights.astype(np.float32)
+
+
+def _get_marker_index(value) -> int | None:
+    if isinstance(value, str) and value.startswith(_WEIGHTS_MARKER_PREFIX):
+        return int(value[len(_WEIGHTS_MARKER_PREFIX) :])
+    return None
+
+
+def _place_weights(
+    value, weights_text: list[str], model_indices: list[int], in_model: bool = False
+):
+    # Keeps the marker of each model's weights and puts any other list of weights
+    # back the way json would have parsed it
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            index = _get_marker_index(item)
+            if index is None:
+                result[key] = _place_weights(
+                    item, weights_text, model_indices, key == "model"
+                )
+            elif in_model and key == "weights":
+                result[key] = item
+                model_indices.append(index)
+            else:
+                result[key] = json.loads(f"[{weights_text[index]}]")
+        return result
+    if isinstance(value, list):
+        return [_place_weights(item, weights_text, model_indices) for item in value]
+    return value
+
+
+def _parse_nam_document(text: str) -> tuple[object, dict[str, list[int]], np.ndarray]:
+    # Returns the document with a marker for each model's weights, the span of
+    # each marker's weights and every model's weights concatenated
+    pieces: list[str] = []
+    weights: list[np.ndarray] = []
+    weights_text: list[str] = []
+    begin = 0
+    for match in _WEIGHTS_PATTERN.finditer(text):
+        if match.start() < begin:
+            continue
+        end = text.find("]", match.end())
+        if end == -1 or text.find("[", match.end(), end) != -1:
+            continue
+        parsed = _parse_weights(text[match.end() : end])
+        if parsed is None:
+            continue
+        marker = json.dumps(f"{_WEIGHTS_MARKER_PREFIX}{len(weights)}")
+        pieces.append(text[begin : match.start()])
+        pieces.append(f'"weights": {marker}')
+        weights.append(parsed)
+        weights_text.append(text[match.end() : end])
+        begin = end + 1
+    pieces.append(text[begin:])
+
+    model_indices: list[int] = []
+    document = _place_weights(json.loads("".join(pieces)), weights_text, model_indices)
+    spans: dict[str, list[int]] = {}
+    offset = 0
+    for index in model_indices:
+        spans[str(index)] = [offset, offset + len(weights[index])]
+        offset += len(weights[index])
+    if len(model_indices) == 0:
+        flat = np.zeros(0, dtype=np.float32)
+    else:
+        flat = np.concatenate([weights[index] for index in model_indices])
+    return document, spans, flat
+
+
+def _restore_weights(value, spans: dict[str, list[int]], flat: np.ndarray):
+    if isinstance(value, dict):
+        return {key: _restore_weights(item, spans, flat) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_restore_weights(item, spans, flat) for item in value]
+    index = _get_marker_index(value)
+    if index is not None:
+        begin, end = spans[str(index)]
+        return np.asarray(flat[begin:end])
+    return value
+
+
+def _write_cache(
+    document_path: str,
+    weights_path: str,
+    document,
+    spans: dict[str, list[int]],
+    flat: np.ndarray,
+) -> None:
+    cache_dir = get_nam_cache_dir()
+    prefix = os.path.basename(weights_path).split("-", 1)[0]
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Entries for earlier versions of this file, unfinished writes are skipped
+        for entry in os.scandir(cache_dir):
+            if (
+                entry.name.startswith(f"{prefix}-")
+                and entry.name.endswith((".json", ".npy"))
+                and entry.path not in (document_path, weights_path)
+            ):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        # The weights are written last so a present .npy always has its document
+        write_file_atomic(
+            document_path,
+            lambda out_file: out_file.write(
+                json.dumps({"spans": spans, "document": document}).encode("utf-8")
+            ),
+        )
+        write_file_atomic(weights_path, lambda out_file: np.save(out_file, flat))
+    except OSError:
+        return
+    evict_cache_entries(cache_dir, NAM_CACHE_MAX_BYTES, weights_path)
+
+
+def _read_cache(
+    document_path: str, weights_path: str
+) -> tuple[object, dict[str, list[int]], np.ndarray] | None:
+    if not os.path.isfile(document_path) or not os.path.isfile(weights_path):
+        return None
+    try:
+        with open(document_path, "r", encoding="utf-8") as document_file:
+            cached = json.load(document_file)
+        flat = np.load(weights_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or "spans" not in cached:
+        return None
+    touch_cache_entry(weights_path)
+    return cached.get("document"), cached["spans"], flat
+
+
+def _get_nam_cache_paths(path: str) -> tuple[str, str]:
+    # Keyed on the path and version of the file like the resample cache, so a
+    # hit doesn't read the file and an edited file gets a new entry
+    file_stat = os.stat(path)
+    source_key = os.path.abspath(path)
+    version_key = f"{file_stat.st_mtime_ns}|{file_stat.st_size}"
+    prefix = hashlib.sha1(source_key.encode("utf-8")).hexdigest()
+    digest = hashlib.sha1(version_key.encode("utf-8")).hexdigest()
+    base_path = os.path.join(get_nam_cache_dir(), f"{prefix}-{digest}")
+    return f"{base_path}.json", f"{base_path}.npy"
+
+
+def load_nam_json(path: str, use_cache: bool = True) -> dict:
+    # Parses a .nam file like json.load, except the weights of each model, the
+    # "weights" list of a "model" object, are float32 arrays. With the cache they
+    # are read-only and mapped from a file keyed by the path and version of the
+    # .nam file
+    document_path, weights_path = _get_nam_cache_paths(path)
+    cached = _read_cache(document_path, weights_path) if use_cache else None
+    if cached is None:
+        with open(path, "rb") as file:
+            data = file.read()
+        document, spans, flat = _parse_nam_document(data.decode("utf-8"))
+        if use_cache:
+            _write_cache(document_path, weights_path, document, spans, flat)
+    else:
+        document, spans, flat = cached
+    return _restore_weights(document, spans, flat)
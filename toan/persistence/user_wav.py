@@ -2,15 +2,17 @@
 # https://www.gnu.org/licenses/gpl-3.0.en.html
 # SPDX-License-Identifier: GPL-3.0-only
 
+import json
+import math
 import os
-import warnings
 from dataclasses import dataclass
 from pathlib import Path
 
 import numpy as np
 import platformdirs
-from scipy.io import wavfile
+import soundfile as sf
 
+from toan.persistence.atomic_write import write_file_atomic
 from toan.signal.mix import concat_signals
 from toan.wav import load_and_resample_wav
 
@@ -21,6 +23,12 @@ class UserWavDesc:
     filename: str
     sample_rate: int
     duration: float
+    peak: float
+    rms: float
+
+
+USER_WAV_INDEX_VERSION = 1
+USER_WAV_SCAN_BLOCK_SIZE = 1 << 20
 
 
 def create_user_wav_dir() -> None:
@@ -39,16 +47,86 @@ def do_user_wavs_exist() -> bool:
     return False
 
 
+def _get_user_wav_index_path() -> str:
+    root_dir = platformdirs.user_data_dir("toan", "toan")
+    return os.path.join(root_dir, "extra_index.json")
+
+
+def _load_user_wav_index() -> dict[str, dict]:
+    try:
+        with open(_get_user_wav_index_path(), "r", encoding="utf-8") as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(index, dict) or index.get("version") != USER_WAV_INDEX_VERSION:
+        return {}
+    return index["files"]
+
+
+def _save_user_wav_index(files: dict[str, dict]) -> None:
+    index = {"version": USER_WAV_INDEX_VERSION, "files": files}
+    try:
+        write_file_atomic(
+            _get_user_wav_index_path(),
+            lambda out_file: out_file.write(json.dumps(index).encode("utf-8")),
+        )
+    except OSError:
+        pass
+
+
+def _scan_user_wav(path: Path, file_stat: os.stat_result) -> dict:
+    # Levels are read in blocks so long takes are never fully in memory
+    info = sf.info(path)
+    peak = 0.0
+    square_sum = 0.0
+    for block in sf.blocks(path, blocksize=USER_WAV_SCAN_BLOCK_SIZE, dtype="float32"):
+        if block.ndim == 2:
+            block = block[:, 0]
+        if len(block) == 0:
+            continue
+        peak = max(peak, float(np.max(np.abs(block))))
+        square_sum += float(np.dot(block, block))
+    return {
+        "size": file_stat.st_size,
+        "mtime_ns": file_stat.st_mtime_ns,
+        "sample_rate": info.samplerate,
+        "frames": info.frames,
+        "peak": peak,
+        "rms": math.sqrt(square_sum / info.frames) if info.frames > 0 else 0.0,
+    }
+
+
 def get_user_wav_list() -> list[UserWavDesc]:
+    # Files are only read when they are new or changed since the last listing
     result = []
     wav_dir = Path(get_user_wav_dir())
+    old_index = _load_user_wav_index()
+    new_index: dict[str, dict] = {}
+    changed = False
     for file in wav_dir.glob("*.wav"):
         path = wav_dir / file.name
-        with warnings.catch_warnings():
-            warnings.filterwarnings("ignore", category=wavfile.WavFileWarning)
-            sample_rate, wav_data = wavfile.read(path)
-        duration = len(wav_data) / sample_rate
-        result.append(UserWavDesc(str(path), file.name, sample_rate, duration))
+        file_stat = path.stat()
+        entry = old_index.get(file.name)
+        if (
+            entry is None
+            or entry["size"] != file_stat.st_size
+            or entry["mtime_ns"] != file_stat.st_mtime_ns
+        ):
+            entry = _scan_user_wav(path, file_stat)
+            changed = True
+        new_index[file.name] = entry
+        result.append(
+            UserWavDesc(
+                str(path),
+                file.name,
+                entry["sample_rate"],
+                entry["frames"] / entry["sample_rate"],
+                entry["peak"],
+                entry["rms"],
+            )
+        )
+    if changed or len(new_index) != len(old_index):
+        _save_user_wav_index(new_index)
     return result
 
 
@@ -0,0 +1,59 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import hashlib
+import os
+import shutil
+import zipfile
+
+import platformdirs
+
+from toan.persistence.atomic_write import write_file_atomic
+from toan.persistence.cache_eviction import evict_cache_entries, touch_cache_entry
+
+# Least recently used members are removed once the cache grows past this
+ZIP_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def get_zip_cache_dir() -> str:
+    root_dir = platformdirs.user_cache_dir("toan", "toan")
+    return os.path.join(root_dir, "zip")
+
+
+def _get_member_cache_path(zip_path: str, info: zipfile.ZipInfo) -> str:
+    # Keyed on the archive identity and the member checksum, a rewritten
+    # archive gets a new entry rather than reusing stale data
+    zip_stat = os.stat(zip_path)
+    key = "|".join(
+        [
+            os.path.abspath(zip_path),
+            str(zip_stat.st_mtime_ns),
+            str(zip_stat.st_size),
+            info.filename,
+            str(info.CRC),
+            str(info.file_size),
+        ]
+    )
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    extension = os.path.splitext(info.filename)[1]
+    return os.path.join(get_zip_cache_dir(), f"{digest}{extension}")
+
+
+def extract_zip_member_cached(
+    zip_file: zipfile.ZipFile, zip_path: str, member: str
+) -> str:
+    info = zip_file.getinfo(member)
+    cache_path = _get_member_cache_path(zip_path, info)
+    if os.path.isfile(cache_path) and os.path.getsize(cache_path) == info.file_size:
+        touch_cache_entry(cache_path)
+        return cache_path
+    os.makedirs(get_zip_cache_dir(), exist_ok=True)
+
+    def write(out_file):
+        with zip_file.open(info) as member_file:
+            shutil.copyfileobj(member_file, out_file)
+
+    write_file_atomic(cache_path, write)
+    evict_cache_entries(get_zip_cache_dir(), ZIP_CACHE_MAX_BYTES, cache_path)
+    return cache_path
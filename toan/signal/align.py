@@ -0,0 +1,318 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import math
+from dataclasses import dataclass
+
+import numpy as np
+import scipy
+
+# Windowed sinc used to read the wet signal between samples
+_FRACTIONAL_DELAY_HALF_TAPS = 16
+_FRACTIONAL_DELAY_KAISER_BETA = 8.0
+_FRACTIONAL_DELAY_PHASES = 1024
+_PEAK_SEARCH_COARSE_STEP = 32
+
+# Drift is applied in blocks with a constant shift, sized so the position error at
+# either end of a block stays around this many samples
+_DRIFT_BLOCK_ERROR = 0.01
+_DRIFT_BLOCK_MIN_SIZE = 1024
+_DIRECT_CONVOLVE_MAX_SIZE = 65536
+
+_MAX_DRIFT = 2e-4
+_MIN_DRIFT_DISTANCE = 65536
+_DRIFT_WINDOW_SIZE = 16384
+_DRIFT_WINDOW_COUNT = 16
+_MIN_CORRELATION = 0.3
+_DEDRIFTED_MAX_LAG = 4
+
+# Fraction of its peak where the envelope of a click counts as begun
+_ONSET_ENVELOPE_LEVEL = 0.5
+
+_fractional_delay_kernel_cache: dict[int, np.ndarray] = {}
+
+
+@dataclass
+class SignalAlignment:
+    # The wet position of dry sample n is n + latency + drift * (n - reference)
+    latency: float
+    drift: float = 0.0
+    reference: int = 0
+
+    def wet_position(self, dry_index: float) -> float:
+        return dry_index + self.latency + self.drift * (dry_index - self.reference)
+
+    def is_integral(self) -> bool:
+        return self.drift == 0.0 and self.latency == round(self.latency)
+
+
+def _energy_centroid(signal: np.ndarray) -> float:
+    energy = np.square(signal)
+    total = np.sum(energy)
+    if total == 0.0:
+        return (len(signal) - 1) / 2
+    return float(np.dot(np.arange(len(signal)), energy) / total)
+
+
+def _envelope_onset(signal: np.ndarray) -> float | None:
+    # Fractional index where the envelope first reaches its onset level
+    envelope = np.abs(scipy.signal.hilbert(np.asarray(signal, dtype=np.float64)))
+    peak = np.max(envelope, initial=0.0)
+    if peak == 0.0:
+        return None
+    threshold = peak * _ONSET_ENVELOPE_LEVEL
+    index = int(np.argmax(envelope >= threshold))
+    if index == 0:
+        return 0.0
+    below = envelope[index - 1]
+    above = envelope[index]
+    return index - 1 + (threshold - below) / (above - below)
+
+
+def _interpolate_peak(values: np.ndarray, peak: int) -> float:
+    # Offset within a sample either side of peak where the band-limited values are
+    # largest, read through the fractional delay kernel at a coarse then fine step
+    padded = np.pad(values * np.sign(values[peak]), _FRACTIONAL_DELAY_HALF_TAPS)
+
+    def read(position: int) -> float:
+        integral, phase = divmod(position, _FRACTIONAL_DELAY_PHASES)
+        window = padded[integral + 1 : integral + 1 + 2 * _FRACTIONAL_DELAY_HALF_TAPS]
+        return float(np.dot(window, _get_fractional_delay_kernel(phase)[::-1]))
+
+    best = peak * _FRACTIONAL_DELAY_PHASES
+    for step in (_PEAK_SEARCH_COARSE_STEP, 1):
+        radius = _FRACTIONAL_DELAY_PHASES if step > 1 else _PEAK_SEARCH_COARSE_STEP
+        candidates = range(best - radius, best + radius + 1, step)
+        best = max(candidates, key=read)
+    return best / _FRACTIONAL_DELAY_PHASES - peak
+
+
+def find_correlation_latency(
+    dry: np.ndarray,
+    wet: np.ndarray,
+    begin: int,
+    end: int,
+    coarse_latency: int,
+    max_lag: int,
+) -> tuple[float, float] | None:
+    # Returns the fractional latency with the strongest correlation within max_lag
+    # of coarse_latency, and the normalized correlation at that latency
+    # Trim the dry range so every lag stays within the wet signal
+    begin = max(begin, max_lag - coarse_latency, 0)
+    end = min(end, len(wet) - coarse_latency - max_lag, len(dry))
+    if end <= begin:
+        return None
+    wet_begin = begin + coarse_latency - max_lag
+    wet_end = end + coarse_latency + max_lag
+    dry_segment = np.asarray(dry[begin:end], dtype=np.float64)
+    wet_segment = np.asarray(wet[wet_begin:wet_end], dtype=np.float64)
+    correlation = scipy.signal.correlate(
+        wet_segment, dry_segment, mode="valid", method="fft"
+    )
+    # Polarity inverting gear correlates negatively
+    peak = int(np.argmax(np.abs(correlation)))
+    offset = 0.0
+    if 0 < peak < len(correlation) - 1:
+        offset = _interpolate_peak(correlation, peak)
+    energy = math.sqrt(
+        np.dot(dry_segment, dry_segment)
+        * np.sum(np.square(wet_segment[peak : peak + len(dry_segment)]))
+    )
+    if energy == 0.0:
+        return None
+    latency = coarse_latency - max_lag + peak + offset
+    return latency, abs(correlation[peak]) / energy
+
+
+def _find_drift(
+    dry: np.ndarray,
+    wet: np.ndarray,
+    calibration_latency: float,
+    reference: int,
+    segments: list[tuple[int, int]],
+    max_lag: int,
+) -> float:
+    # Theil-Sen fit over the calibration point and short windows spread over each
+    # segment, windows on tonal material may lock onto the wrong period
+    points = [(float(reference), calibration_latency)]
+    for segment_begin, segment_end in segments:
+        window_count = min(
+            (segment_end - segment_begin) // _DRIFT_WINDOW_SIZE, _DRIFT_WINDOW_COUNT
+        )
+        if window_count <= 0:
+            continue
+        for window_begin in np.linspace(
+            segment_begin, segment_end - _DRIFT_WINDOW_SIZE, window_count, dtype=int
+        ):
+            window_end = window_begin + _DRIFT_WINDOW_SIZE
+            distance = (window_begin + window_end) / 2 - reference
+            result = find_correlation_latency(
+                dry,
+                wet,
+                window_begin,
+                window_end,
+                round(calibration_latency),
+                max_lag + math.ceil(abs(distance) * _MAX_DRIFT),
+            )
+            if result is None or result[1] < _MIN_CORRELATION:
+                continue
+            points.append((reference + distance, result[0]))
+    slopes = [
+        (latency_b - latency_a) / (position_b - position_a)
+        for i, (position_a, latency_a) in enumerate(points)
+        for position_b, latency_b in points[i + 1 :]
+        if abs(position_b - position_a) >= _MIN_DRIFT_DISTANCE
+    ]
+    if len(slopes) == 0:
+        return 0.0
+    drift = float(np.median(slopes))
+    if abs(drift) > _MAX_DRIFT:
+        return 0.0
+    return drift
+
+
+def estimate_alignment(
+    dry: np.ndarray,
+    wet: np.ndarray,
+    coarse_latency: int,
+    calibration: tuple[int, int],
+    refinement: list[tuple[int, int]] | None = None,
+    max_lag: int = 64,
+) -> SignalAlignment | None:
+    calibration_begin, calibration_end = calibration
+    calibration_result = find_correlation_latency(
+        dry, wet, calibration_begin, calibration_end, coarse_latency, max_lag
+    )
+    if calibration_result is None or calibration_result[1] < _MIN_CORRELATION:
+        return None
+    calibration_latency = calibration_result[0]
+    reference = calibration_begin + round(
+        _energy_centroid(dry[calibration_begin:calibration_end])
+    )
+
+    drift = 0.0
+    if refinement is not None:
+        drift = _find_drift(
+            dry, wet, calibration_latency, reference, refinement, max_lag
+        )
+    if drift != 0.0:
+        # Clicks at either end of the calibration block drift apart, measure again
+        # with the drift removed so their peaks line up
+        base_latency = round(calibration_latency)
+        dedrifted = align_wet_signal(
+            wet,
+            SignalAlignment(
+                latency=float(base_latency), drift=drift, reference=reference
+            ),
+            calibration_begin,
+            calibration_end,
+        )
+        dedrifted_result = find_correlation_latency(
+            dry[calibration_begin:calibration_end],
+            dedrifted,
+            0,
+            len(dedrifted),
+            0,
+            _DEDRIFTED_MAX_LAG,
+        )
+        if dedrifted_result is not None:
+            calibration_latency = base_latency + dedrifted_result[0]
+
+    # The correlation peak can trail the onset of the gear's response, compare the
+    # wet calibration block aligned to the peak with the dry one and move earlier
+    # by however much the wet response begins first so it never leads the dry
+    latency = calibration_latency
+    dry_onset = _envelope_onset(dry[calibration_begin:calibration_end])
+    wet_onset = _envelope_onset(
+        align_wet_signal(
+            wet,
+            SignalAlignment(latency=latency, drift=drift, reference=reference),
+            calibration_begin,
+            calibration_end,
+        )
+    )
+    if dry_onset is not None and wet_onset is not None:
+        latency -= min(max(dry_onset - wet_onset, 0.0), float(max_lag))
+
+    return SignalAlignment(latency=latency, drift=drift, reference=reference)
+
+
+def _get_fractional_delay_kernel(phase: int) -> np.ndarray:
+    # Taps for reading the signal phase / _FRACTIONAL_DELAY_PHASES past a sample,
+    # reversed for use with convolve
+    kernel = _fractional_delay_kernel_cache.get(phase)
+    if kernel is not None:
+        return kernel
+    taps = np.arange(-_FRACTIONAL_DELAY_HALF_TAPS + 1, _FRACTIONAL_DELAY_HALF_TAPS + 1)
+    x = taps - phase / _FRACTIONAL_DELAY_PHASES
+    window = np.i0(
+        _FRACTIONAL_DELAY_KAISER_BETA
+        * np.sqrt(np.clip(1.0 - np.square(x / _FRACTIONAL_DELAY_HALF_TAPS), 0.0, 1.0))
+    ) / np.i0(_FRACTIONAL_DELAY_KAISER_BETA)
+    kernel = np.sinc(x) * window
+    kernel = (kernel / np.sum(kernel))[::-1].astype(np.float32)
+    _fractional_delay_kernel_cache[phase] = kernel
+    return kernel
+
+
+def _take_zero_padded(signal: np.ndarray, begin: int, end: int) -> np.ndarray:
+    if begin >= 0 and end <= len(signal):
+        return signal[begin:end]
+    result = np.zeros(end - begin, dtype=np.float32)
+    source_begin = max(begin, 0)
+    source_end = min(end, len(signal))
+    if source_end > source_begin:
+        result[source_begin - begin : source_end - begin] = signal[
+            source_begin:source_end
+        ]
+    return result
+
+
+def align_wet_signal(
+    wet: np.ndarray, alignment: SignalAlignment, dry_begin: int, dry_end: int
+) -> np.ndarray:
+    # Returns the wet signal matching dry[dry_begin:dry_end], trimmed where the
+    # wet recording ends
+    scale = 1.0 + alignment.drift
+    last_position = len(wet) - 1
+    available = math.floor(
+        (last_position - alignment.wet_position(0)) / scale - dry_begin + 1
+    )
+    length = max(min(dry_end - dry_begin, available), 0)
+    if alignment.is_integral():
+        begin = dry_begin + round(alignment.latency)
+        return _take_zero_padded(wet, begin, begin + length)
+
+    if alignment.drift == 0.0:
+        block_size = max(length, 1)
+    else:
+        block_size = max(
+            int(_DRIFT_BLOCK_ERROR * 2 / abs(alignment.drift)), _DRIFT_BLOCK_MIN_SIZE
+        )
+    result = np.empty(length, dtype=np.float32)
+    for block_begin in range(0, length, block_size):
+        this_block_size = min(block_size, length - block_begin)
+        half_width = (this_block_size - 1) / 2
+        center = dry_begin + block_begin + half_width
+        position = alignment.wet_position(center) - half_width
+        integral = math.floor(position)
+        phase = round((position - integral) * _FRACTIONAL_DELAY_PHASES)
+        if phase == 0 or phase == _FRACTIONAL_DELAY_PHASES:
+            integral += phase // _FRACTIONAL_DELAY_PHASES
+            result[block_begin : block_begin + this_block_size] = _take_zero_padded(
+                wet, integral, integral + this_block_size
+            )
+            continue
+        segment = _take_zero_padded(
+            wet,
+            integral - _FRACTIONAL_DELAY_HALF_TAPS + 1,
+            integral + this_block_size + _FRACTIONAL_DELAY_HALF_TAPS,
+        )
+        kernel = _get_fractional_delay_kernel(phase)
+        if this_block_size > _DIRECT_CONVOLVE_MAX_SIZE:
+            block = scipy.signal.oaconvolve(segment, kernel, mode="valid")
+        else:
+            block = np.convolve(segment, kernel, mode="valid")
+        result[block_begin : block_begin + this_block_size] = block
+    return result
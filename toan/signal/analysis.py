@@ -17,52 +17,39 @@ class SignalClickDetails:
     magnitude: float
 
 
-@dataclass
-class _PotentialClick:
-    index_begin: int = 0
-    index_peak: int = 0
-    magnitude: float = 0.0
-    width: int = 0
-
-
-def _sort_clicks(click: _PotentialClick) -> float:
-    return click.width * click.magnitude
-
-
-def _find_clicks(signal: np.ndarray, noise_threshold: float) -> list[_PotentialClick]:
-    result = []
-    silence_samples_required = 500
-    silence_samples_remaining = silence_samples_required
-    current_click = _PotentialClick()
-    for i in range(len(signal)):
-        current_click.width += 1
-        this_sample = signal[i]
-        this_sample_abs = np.abs(this_sample)
-        if this_sample_abs > noise_threshold:
-            if silence_samples_remaining <= 0:
-                current_click = _PotentialClick(index_begin=i)
-                result.append(current_click)
-            silence_samples_remaining = silence_samples_required
-            if this_sample_abs > current_click.magnitude:
-                current_click.magnitude = this_sample_abs
-                current_click.index_peak = i
-        else:
-            silence_samples_remaining -= 1
-    return result
+# A click begins at the first loud sample after this many quiet ones
+_CLICK_SILENCE_SAMPLES = 500
+
+
+def _find_clicks(
+    signal_abs: np.ndarray, loud_indices: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    # Returns the begin index and score of each potential click, the start of the
+    # signal counts as loud so a click cannot begin within the first 500 samples
+    quiet_runs = np.diff(loud_indices, prepend=-1) - 1
+    begins = loud_indices[quiet_runs >= _CLICK_SILENCE_SAMPLES]
+    if len(begins) == 0:
+        return begins, np.zeros(0, dtype=np.float64)
+    # Each click spans up to the next one, its width counts the samples after the
+    # first and includes the begin of the next click
+    widths = np.diff(begins, append=len(signal_abs) - 1)
+    magnitudes = np.maximum.reduceat(signal_abs, begins)
+    if np.issubdtype(magnitudes.dtype, np.floating):
+        widths = widths.astype(magnitudes.dtype)
+    return begins, widths * magnitudes
 
 
 def _find_wet_clicks(
-    signal: np.ndarray, noise_threshold: float
+    signal_abs: np.ndarray, loud_indices: np.ndarray, noise_threshold: float
 ) -> SignalClickDetails | None:
-    maybe_clicks = _find_clicks(signal, noise_threshold)
-    maybe_clicks.sort(key=_sort_clicks)
-    if len(maybe_clicks) < 2:
+    begins, scores = _find_clicks(signal_abs, loud_indices)
+    if len(begins) < 2:
         return None
-    click_indices = [click.index_begin for click in maybe_clicks[-2:]]
-    click_indices.sort()
+    # Stable so equal scores keep the later click, as a stable list sort would
+    click_indices = np.sort(begins[np.argsort(scores, kind="stable")[-2:]])
     return SignalClickDetails(
-        first_click=click_indices[0],
-        delta=click_indices[1] - click_indices[0],
+        first_click=int(click_indices[0]),
+        delta=int(click_indices[1] - click_indices[0]),
         magnitude=noise_threshold,
     )
 
@@ -71,17 +58,14 @@ def find_dry_clicks(signal: np.ndarray) -> SignalClickDetails | None:
     assert signal.ndim == 1
     eps = 0.001
 
-    click_indices: list[int] = []
-    for i in range(len(signal)):
-        if signal[i] > eps:
-            click_indices.append(i)
+    click_indices = np.flatnonzero(signal > eps)
 
     if len(click_indices) != 2:
         return None
 
     return SignalClickDetails(
-        first_click=click_indices[0],
-        delta=click_indices[1] - click_indices[0],
+        first_click=int(click_indices[0]),
+        delta=int(click_indices[1] - click_indices[0]),
         magnitude=eps,
     )
 
@@ -89,14 +73,21 @@ def find_dry_clicks(signal: np.ndarray) -> SignalClickDetails | None:
 def find_wet_clicks(
     signal: np.ndarray, quiet_samples: int, target_delta: int
 ) -> SignalClickDetails | None:
-    noise_floor = np.max(np.abs(signal[:quiet_samples]))
+    signal_abs = np.abs(signal)
+    noise_floor = np.max(signal_abs[:quiet_samples])
     # Attempt finding clicks at all of these thresholds and choose best
     magnitudes = [1.5, 2.0, 3.0, 4.0, 6.0, 8.0, 12.0, 16.0, 24.0, 32.0]
+    thresholds = [magnitude * noise_floor for magnitude in magnitudes]
+    # Loud samples at every threshold are a subset of those at the lowest one, so
+    # the full signal is only scanned once
+    candidate_indices = np.flatnonzero(signal_abs > min(thresholds))
+    candidate_values = signal_abs[candidate_indices]
     best_match: SignalClickDetails | None = None
     # This default must exceed our desired click delta delta
     best_score: int = 1000
-    for magnitude in magnitudes:
-        maybe_result = _find_wet_clicks(signal, magnitude * noise_floor)
+    for threshold in thresholds:
+        loud_indices = candidate_indices[candidate_values > threshold]
+        maybe_result = _find_wet_clicks(signal_abs, loud_indices, threshold)
         if maybe_result is None:
             continue
         delta_delta = abs(target_delta - maybe_result.delta)
@@ -2,7 +2,9 @@
 # https://www.gnu.org/licenses/gpl-3.0.en.html
 # SPDX-License-Identifier: GPL-3.0-only
 
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
+from typing import Callable
 
 import numpy as np
 
@@ -17,6 +19,17 @@ from toan.signal.generator.trig import generate_cosine_wave, generate_sine_wave
 from toan.signal.generator.warble import generate_warble_chord
 from toan.signal.mix import concat_signals
 
+# Part of the capture signal cache key, bump when a change alters generated signals
+CAPTURE_SIGNAL_VERSION = 2
+
+# Each random task is seeded from rand_seed and its place in the signal, so the
+# result does not depend on the order or process the tasks run in
+_SEED_BLOCK_SWEEP = 0
+_SEED_BLOCK_WARBLE = 1
+_SEED_BLOCK_PLUCKED = 2
+_SEED_BLOCK_WHITE_NOISE = 3
+_SEED_BLOCK_BUILTIN_WAV = 4
+
 
 @dataclass
 class ChordWithEffects:
@@ -196,62 +209,44 @@ def _generate_sweep_block(
     )
 
 
-def _generate_warble_block(
+def _generate_warble_chord(
     sample_rate: int,
-    chords: list[ChordWithEffects],
+    chord: ChordWithEffects,
     duration: float,
     octave_scale: float,
 ) -> np.ndarray:
-    if len(chords) == 0:
-        return np.zeros(1)
-
-    def generate_warble_signal(shape: ChordType):
-        return generate_warble_chord(
-            sample_rate, duration, 55.0, shape, 10, octave_scale
-        )
-
     buffer_size = int(sample_rate * duration)
     modulation = generate_gaussian_pulse(buffer_size, 2)
-    chord_buffers = []
-    for chord in chords:
-        this_chord_buffer = generate_warble_signal(chord.chord)
-        this_chord_buffer = apply_effect(this_chord_buffer, sample_rate, chord.effect)
-        assert len(modulation) == len(this_chord_buffer)
-        chord_buffers.append(this_chord_buffer * modulation)
-    return concat_signals(chord_buffers, sample_rate // 4)
+    chord_buffer = generate_warble_chord(
+        sample_rate, duration, 55.0, chord.chord, 10, octave_scale
+    )
+    chord_buffer = apply_effect(chord_buffer, sample_rate, chord.effect)
+    assert len(modulation) == len(chord_buffer)
+    return chord_buffer * modulation
 
 
-def _generate_plucked_block(
+def _generate_plucked_chord(
     sample_rate: int,
-    chords: list[ChordWithEffects],
+    chord: ChordWithEffects,
+    index: int,
     note_duration: float,
     pluck_decay: float,
     pre_smooth: int = 0,
 ) -> np.ndarray:
-    if len(chords) == 0:
-        return np.zeros(1)
-
-    def generate_plucked_scale(shape: ChordType, offset_duration: float):
-        return generate_named_chord_pluck_scale(
-            shape,
-            sample_rate,
-            "E",
-            1,
-            "G",
-            6,
-            note_duration,
-            offset_duration,
-            pluck_decay,
-            pre_smooth,
-        )
-
-    buffers = []
-    for i, chord in enumerate(chords):
-        offset = i * 0.6e-3
-        this_chord_buffer = generate_plucked_scale(chord.chord, offset)
-        this_chord_buffer = apply_effect(this_chord_buffer, sample_rate, chord.effect)
-        buffers.append(this_chord_buffer)
-    return concat_signals(buffers, sample_rate // 4)
+    offset = index * 0.6e-3
+    chord_buffer = generate_named_chord_pluck_scale(
+        chord.chord,
+        sample_rate,
+        "E",
+        1,
+        "G",
+        6,
+        note_duration,
+        offset,
+        pluck_decay,
+        pre_smooth,
+    )
+    return apply_effect(chord_buffer, sample_rate, chord.effect)
 
 
 def _generate_white_noise_block(sample_rate: int, duration: float) -> np.ndarray:
@@ -261,48 +256,117 @@ def _generate_white_noise_block(sample_rate: int, duration: float) -> np.ndarray
     return white_noise * pulse
 
 
-def _generate_builtin_wav_block(sample_rate: int, wavs: list[BuiltinWav]) -> np.ndarray:
-    if len(wavs) == 0:
+def _concat_block(sample_rate: int, buffers: list[np.ndarray]) -> np.ndarray:
+    if len(buffers) == 0:
         return np.zeros(1)
-    buffers = []
-    for wav in wavs:
-        this_signal = get_builtin_wav_signal(sample_rate, wav)
-        buffers.append(this_signal)
     return concat_signals(buffers, sample_rate // 4)
 
 
+def _get_task_seed(rand_seed: int, block: int, index: int = 0) -> int:
+    sequence = np.random.SeedSequence(rand_seed, spawn_key=(block, index))
+    return int(sequence.generate_state(1)[0])
+
+
+def _run_seeded_task(seed: int, function: Callable, *args):
+    rng_state = np.random.get_state()
+    np.random.seed(seed)
+    try:
+        return function(*args)
+    finally:
+        np.random.set_state(rng_state)
+
+
+# More processes than this only add startup cost for the handful of long tasks
+CAPTURE_SIGNAL_MAX_WORKERS = 8
+
+
+def _run_tasks(tasks: list[tuple[int, Callable, tuple]], workers: int) -> list:
+    workers = min(workers, len(tasks), CAPTURE_SIGNAL_MAX_WORKERS)
+    if workers <= 1:
+        return [
+            _run_seeded_task(seed, function, *args) for seed, function, args in tasks
+        ]
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(_run_seeded_task, seed, function, *args)
+            for seed, function, args in tasks
+        ]
+        return [future.result() for future in futures]
+
+
 def generate_capture_signal(
-    sample_rate: int, config: CaptureSignalConfig = CaptureSignalConfig()
+    sample_rate: int,
+    config: CaptureSignalConfig = CaptureSignalConfig(),
+    workers: int = 0,
 ) -> CaptureSignalWithDetails:
-    rng_state = np.random.get_state()
-    np.random.seed(config.rand_seed)
+    # With more than one worker the blocks and chords are generated in a process
+    # pool, the signal is identical for any worker count. Starting the pool costs
+    # about as much as it saves on small machines, so callers opt in
+    seed = config.rand_seed
+    tasks: list[tuple[int, Callable, tuple]] = [
+        (
+            _get_task_seed(seed, _SEED_BLOCK_SWEEP),
+            _generate_sweep_block,
+            (
+                sample_rate,
+                config.sweep_duration,
+                config.multisweep_layers,
+                config.small_sweep_begins,
+                config.small_sweep_magnitudes,
+            ),
+        ),
+        (
+            _get_task_seed(seed, _SEED_BLOCK_WHITE_NOISE),
+            _generate_white_noise_block,
+            (sample_rate, config.noise_duration),
+        ),
+    ]
+    for i, chord in enumerate(config.warble_chords):
+        tasks.append(
+            (
+                _get_task_seed(seed, _SEED_BLOCK_WARBLE, i),
+                _generate_warble_chord,
+                (
+                    sample_rate,
+                    chord,
+                    config.warble_duration,
+                    config.warble_octave_scale,
+                ),
+            )
+        )
+    for i, chord in enumerate(config.plucked_chords):
+        tasks.append(
+            (
+                _get_task_seed(seed, _SEED_BLOCK_PLUCKED, i),
+                _generate_plucked_chord,
+                (
+                    sample_rate,
+                    chord,
+                    i,
+                    config.pluck_note_duration,
+                    config.pluck_decay,
+                    config.pluck_pre_smooth,
+                ),
+            )
+        )
+    for i, wav in enumerate(config.builtin_wavs):
+        tasks.append(
+            (
+                _get_task_seed(seed, _SEED_BLOCK_BUILTIN_WAV, i),
+                get_builtin_wav_signal,
+                (sample_rate, wav),
+            )
+        )
+    results = _run_tasks(tasks, workers)
 
-    main_sweep_begin = 0
-    block_sweep, main_sweep_end = _generate_sweep_block(
-        sample_rate,
-        config.sweep_duration,
-        config.multisweep_layers,
-        config.small_sweep_begins,
-        config.small_sweep_magnitudes,
-    )
-    block_warble = _generate_warble_block(
-        sample_rate,
-        config.warble_chords,
-        config.warble_duration,
-        config.warble_octave_scale,
-    )
-    block_plucked = _generate_plucked_block(
-        sample_rate,
-        config.plucked_chords,
-        config.pluck_note_duration,
-        config.pluck_decay,
-        config.pluck_pre_smooth,
-    )
-    block_white_noise = _generate_white_noise_block(sample_rate, config.noise_duration)
-    block_builtin_wavs = _generate_builtin_wav_block(sample_rate, config.builtin_wavs)
+    (block_sweep, main_sweep_end), block_white_noise = results[:2]
+    warble_end = 2 + len(config.warble_chords)
+    plucked_end = warble_end + len(config.plucked_chords)
+    block_warble = _concat_block(sample_rate, results[2:warble_end])
+    block_plucked = _concat_block(sample_rate, results[warble_end:plucked_end])
+    block_builtin_wavs = _concat_block(sample_rate, results[plucked_end:])
 
-    main_sweep_begin += 0
-    main_sweep_end += 0
+    main_sweep_begin = 0
     signal_train = concat_signals(
         [
             block_sweep,
@@ -316,8 +380,6 @@ def generate_capture_signal(
 
     block_calibration = _generate_calibration_block(sample_rate)
 
-    np.random.set_state(rng_state)
-
     silence_half_second = np.zeros(sample_rate // 2)
 
     main_sweep_begin += len(block_calibration) + len(silence_half_second)
@@ -3,22 +3,34 @@
 # SPDX-License-Identifier: GPL-3.0-only
 
 import numpy as np
+import scipy
+
+# Short feedback delays run as a comb filter, longer ones one delay period at a time
+# as the cost of the comb filter grows with the delay
+_COMB_FILTER_MAX_SAMPLES = 128
 
 
 def effect_delay(
     signal: np.ndarray, samples: int, gain: float, feedback: bool
 ) -> np.ndarray:
+    assert samples >= 0
     result = signal.copy()
+    if samples == 0:
+        result += gain * result
+        return result
 
-    def get_sample(index: int) -> float:
-        if index < 0:
-            return 0.0
-        return result[index]
+    if not feedback:
+        result[samples:] += gain * signal[:-samples]
+        return result
 
-    for i in range(len(result)):
-        this_index = i if feedback else len(result) - i - 1
-        result[this_index] = result[this_index] + gain * get_sample(
-            this_index - samples
-        )
+    if samples <= _COMB_FILTER_MAX_SAMPLES:
+        denominator = np.zeros(samples + 1, dtype=result.dtype)
+        denominator[0] = 1.0
+        denominator[samples] = -gain
+        return scipy.signal.lfilter([1.0], denominator, signal).astype(result.dtype)
 
+    # Each period only depends on the one before it
+    for begin in range(samples, len(result), samples):
+        end = min(begin + samples, len(result))
+        result[begin:end] += gain * result[begin - samples : end - samples]
     return result
@@ -5,6 +5,7 @@
 import math
 
 import numpy as np
+import scipy
 
 from toan.music.frequency import increase_frequency_by_semitones
 
@@ -13,6 +14,52 @@ from toan.music.frequency import increase_frequency_by_semitones
 SPLIT_A = 0.60
 
 
+# Short delay lines are filtered in one pass with the delay in the denominator,
+# longer ones one period at a time as the cost of the former grows with the width
+_DENSE_FILTER_MAX_WIDTH = 128
+
+
+def _pre_smooth(buffer: np.ndarray) -> np.ndarray:
+    # One-pole low-pass over the buffer, the first sample mixes with the last
+    return scipy.signal.lfilter(
+        [SPLIT_A],
+        [1.0, -(1.0 - SPLIT_A)],
+        buffer,
+        zi=[(1.0 - SPLIT_A) * buffer[-1]],
+    )[0]
+
+
+def _karplus_strong(
+    buffer: np.ndarray, out_sample_count: int, decay: float
+) -> np.ndarray:
+    # y[i] = decay * (SPLIT_A * x[i] + (1 - SPLIT_A) * y[i - 1]), where x is the
+    # initial buffer for the first period and y[i - width] after that
+    width = len(buffer)
+    gain_delayed = decay * SPLIT_A
+    gain_previous = decay * (1.0 - SPLIT_A)
+
+    if width <= _DENSE_FILTER_MAX_WIDTH:
+        denominator = np.zeros(width + 1)
+        denominator[0] = 1.0
+        denominator[1] -= gain_previous
+        denominator[width] -= gain_delayed
+        excitation = np.zeros(out_sample_count)
+        excitation_count = min(width, out_sample_count)
+        excitation[:excitation_count] = buffer[:excitation_count]
+        return scipy.signal.lfilter([gain_delayed], denominator, excitation)
+
+    result = np.zeros(out_sample_count)
+    period = buffer
+    state = np.zeros(1)
+    for begin in range(0, out_sample_count, width):
+        end = min(begin + width, out_sample_count)
+        period, state = scipy.signal.lfilter(
+            [gain_delayed], [1.0, -gain_previous], period[: end - begin], zi=state
+        )
+        result[begin:end] = period
+    return result
+
+
 # Generate a pluck using a Karplus-Strong filter over random noise
 def generate_pluck(
     sample_rate: int,
@@ -22,26 +69,15 @@ def generate_pluck(
     pre_smooth: int = 0,
 ) -> np.ndarray:
     out_sample_count = int(duration * sample_rate)
-    result = np.zeros(out_sample_count)
 
     buffer_width = int(sample_rate / frequency)
 
     buffer = np.random.uniform(-1.0, 1.0, buffer_width)
     for _ in range(pre_smooth):
-        for i in range(buffer_width):
-            buffer[i] = buffer[i] * SPLIT_A + buffer[i - 1] * (1.0 - SPLIT_A)
+        buffer = _pre_smooth(buffer)
     buffer = buffer / np.max(np.abs(buffer))
 
-    previous: float = 0.0
-
-    for i in range(out_sample_count):
-        buffer_index = i % buffer_width
-        value = decay * (buffer[buffer_index] * SPLIT_A + previous * (1.0 - SPLIT_A))
-        buffer[buffer_index] = value
-        result[i] = value
-        previous = value
-
-    return result
+    return _karplus_strong(buffer, out_sample_count, decay)
 
 
 def generate_generic_chord_pluck(
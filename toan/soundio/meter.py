@@ -0,0 +1,74 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import numpy as np
+
+
+# Level of an input over a rolling window, fed from an audio callback and polled
+# from the gui thread
+# The window is split into buckets so each block only touches the current one, the
+# readers combine the buckets
+class LevelMeter:
+    clip_level: float
+    clip_count: int
+
+    _bucket_size: int
+    _bucket_index: int
+    _bucket_peak: np.ndarray
+    _bucket_square_sum: np.ndarray
+    _bucket_samples: np.ndarray
+
+    def __init__(
+        self, window_samples: int, bucket_count: int = 32, clip_level: float = 0.99
+    ):
+        assert window_samples > 0 and bucket_count > 0
+        self.clip_level = clip_level
+        self._bucket_size = max(window_samples // bucket_count, 1)
+        self._bucket_peak = np.zeros(bucket_count)
+        self._bucket_square_sum = np.zeros(bucket_count)
+        self._bucket_samples = np.zeros(bucket_count, dtype=np.int64)
+        self.reset()
+
+    def reset(self) -> None:
+        self.clip_count = 0
+        self._bucket_index = 0
+        self._bucket_peak.fill(0.0)
+        self._bucket_square_sum.fill(0.0)
+        self._bucket_samples.fill(0)
+
+    def process_block(self, block: np.ndarray) -> None:
+        # Split at bucket boundaries so a long block still ages out one bucket at a
+        # time
+        begin = 0
+        while begin < len(block):
+            index = self._bucket_index
+            if self._bucket_samples[index] >= self._bucket_size:
+                index = (index + 1) % len(self._bucket_samples)
+                self._bucket_peak[index] = 0.0
+                self._bucket_square_sum[index] = 0.0
+                self._bucket_samples[index] = 0
+                self._bucket_index = index
+            end = min(
+                len(block), begin + self._bucket_size - int(self._bucket_samples[index])
+            )
+            self._process_bucket_part(index, block[begin:end])
+            begin = end
+
+    def _process_bucket_part(self, index: int, part: np.ndarray) -> None:
+        part_peak = max(float(part.max()), -float(part.min()))
+        if part_peak >= self.clip_level:
+            # Only counted when something clipped, this allocates
+            self.clip_count += int(np.count_nonzero(np.abs(part) >= self.clip_level))
+        self._bucket_peak[index] = max(self._bucket_peak[index], part_peak)
+        self._bucket_square_sum[index] += float(np.dot(part, part))
+        self._bucket_samples[index] += len(part)
+
+    def peak(self) -> float:
+        return float(self._bucket_peak.max())
+
+    def rms(self) -> float:
+        samples = int(self._bucket_samples.sum())
+        if samples == 0:
+            return 0.0
+        return float(np.sqrt(self._bucket_square_sum.sum() / samples))
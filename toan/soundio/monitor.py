@@ -0,0 +1,115 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import threading
+from typing import Callable
+
+import numpy as np
+import sounddevice as sd
+
+from toan.soundio import SdChannel
+from toan.soundio.ring_buffer import SampleRingBuffer
+
+
+# Plays process applied to one input channel on the default output device
+# process runs on a worker thread so the audio callback only copies samples, the
+# output is one block behind the input and a block that isn't ready in time is
+# played as silence and counted as a dropout
+class MonitorController:
+    sample_rate: int
+    channel_in: SdChannel
+    block_size: int
+    process: Callable[[np.ndarray], np.ndarray]
+    dropouts: int
+
+    stream: sd.Stream
+
+    _input_ring: SampleRingBuffer
+    _output_ring: SampleRingBuffer
+    _callback_block: np.ndarray
+    _worker_block: np.ndarray
+    _ready: threading.Event
+    _stop: threading.Event
+    _thread: threading.Thread | None
+
+    def __init__(
+        self,
+        sample_rate: int,
+        channel_in: SdChannel,
+        block_size: int,
+        process: Callable[[np.ndarray], np.ndarray],
+        queued_blocks: int = 8,
+    ):
+        assert block_size > 0 and queued_blocks > 1
+        self.sample_rate = sample_rate
+        self.channel_in = channel_in
+        self.block_size = block_size
+        self.process = process
+        self.dropouts = 0
+
+        capacity = block_size * queued_blocks
+        self._input_ring = SampleRingBuffer(capacity)
+        self._output_ring = SampleRingBuffer(capacity)
+        # The block of silence played while the first block is processed
+        self._output_ring.write(np.zeros(block_size, dtype=np.float32))
+        self._callback_block = np.zeros(capacity, dtype=np.float32)
+        self._worker_block = np.zeros(block_size, dtype=np.float32)
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Enough input channels to reach the selected one, mono output is copied to
+        # the first two channels of the output device
+        output_device = sd.query_devices(kind="output")
+        output_channels = min(output_device["max_output_channels"], 2)
+        self.stream = sd.Stream(
+            samplerate=sample_rate,
+            blocksize=block_size,
+            device=(channel_in.device_index, None),
+            channels=(channel_in.channel_index, output_channels),
+            callback=self._callback,
+        )
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, daemon=True)
+            self._thread.start()
+        self.stream.start()
+
+    def close(self) -> None:
+        self.stream.close()
+        self._stop.set()
+        self._ready.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _callback(
+        self,
+        indata: np.ndarray,
+        outdata: np.ndarray,
+        frames: int,
+        time,
+        status: sd.CallbackFlags,
+    ) -> None:
+        written = self._input_ring.write(indata[:, self.channel_in.channel_index - 1])
+        self._ready.set()
+        block = self._callback_block[:frames]
+        read = self._output_ring.read(block)
+        if written < frames or read < frames:
+            block[read:] = 0.0
+            self.dropouts += 1
+        outdata[:] = block[:, None]
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            if not self._ready.wait(timeout=0.1):
+                continue
+            # Cleared before reading so a block written meanwhile sets it again
+            self._ready.clear()
+            while not self._stop.is_set():
+                count = self._input_ring.read(self._worker_block)
+                if count == 0:
+                    break
+                self._output_ring.write(self.process(self._worker_block[:count]))
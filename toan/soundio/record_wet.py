@@ -2,14 +2,13 @@
 # https://www.gnu.org/licenses/gpl-3.0.en.html
 # SPDX-License-Identifier: GPL-3.0-only
 
-import threading
 from dataclasses import dataclass
 
 import numpy as np
 import sounddevice as sd
 
-from toan.signal.mix import concat_signals
 from toan.soundio import SdChannel, SdIoController
+from toan.soundio.meter import LevelMeter
 
 
 @dataclass
@@ -26,11 +25,13 @@ class RecordWetController:
     channel_out: SdChannel
 
     progress: RecordWetProgress
+    level_meter: LevelMeter | None
 
     controller: SdIoController
 
-    _recorded_segment_lock: threading.Lock
-    _recorded_segments: list[np.ndarray]
+    # Only the input callback writes here, samples below progress.samples_recorded
+    # are complete and never written again
+    _recorded_signal: np.ndarray
 
     def __init__(
         self,
@@ -38,13 +39,14 @@ class RecordWetController:
         dry_signal: np.ndarray,
         channel_in: SdChannel,
         channel_out: SdChannel,
+        level_meter: LevelMeter | None = None,
     ):
         self.sample_rate = sample_rate
         self.dry_signal = dry_signal
         self.channel_in = channel_in
         self.channel_out = channel_out
-        self._recorded_segment_lock = threading.Lock()
-        self._recorded_segments = []
+        self.level_meter = level_meter
+        self._recorded_signal = np.zeros(len(dry_signal), dtype=np.float32)
 
         self.progress = RecordWetProgress(
             samples_to_play=len(dry_signal),
@@ -65,9 +67,8 @@ class RecordWetController:
         self.controller.close()
 
     def get_recorded_signal(self) -> np.ndarray:
-        with self._recorded_segment_lock:
-            full_result = concat_signals(self._recorded_segments)
-            return full_result[: len(self.dry_signal)]
+        recorded_count = min(self.progress.samples_recorded, len(self.dry_signal))
+        return self._recorded_signal[:recorded_count].copy()
 
     def is_complete(self) -> bool:
         return self.progress is not None and self.progress.samples_recorded >= len(
@@ -81,8 +82,12 @@ class RecordWetController:
             return
         channel_data = data[:, self.channel_in.channel_index - 1]
         assert channel_data.ndim == 1
-        with self._recorded_segment_lock:
-            self._recorded_segments.append(channel_data.copy())
+        if self.level_meter is not None:
+            self.level_meter.process_block(channel_data)
+        begin = self.progress.samples_recorded
+        end = min(begin + len(channel_data), len(self._recorded_signal))
+        self._recorded_signal[begin:end] = channel_data[: end - begin]
+        # Published after the write so a reader never sees unwritten samples
         self.progress.samples_recorded += len(channel_data)
 
     def _callback_output(
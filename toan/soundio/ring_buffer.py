@@ -0,0 +1,52 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import threading
+
+import numpy as np
+
+
+# Fixed size FIFO of samples shared between an audio callback and a worker thread,
+# the lock is only held while samples are copied in or out
+class SampleRingBuffer:
+    capacity: int
+
+    _buffer: np.ndarray
+    _read_index: int
+    _count: int
+    _lock: threading.Lock
+
+    def __init__(self, capacity: int):
+        assert capacity > 0
+        self.capacity = capacity
+        self._buffer = np.zeros(capacity, dtype=np.float32)
+        self._read_index = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def available(self) -> int:
+        with self._lock:
+            return self._count
+
+    # Returns how many samples were written, samples that don't fit are dropped
+    def write(self, samples: np.ndarray) -> int:
+        with self._lock:
+            count = min(len(samples), self.capacity - self._count)
+            write_index = (self._read_index + self._count) % self.capacity
+            first = min(count, self.capacity - write_index)
+            self._buffer[write_index : write_index + first] = samples[:first]
+            self._buffer[: count - first] = samples[first:count]
+            self._count += count
+        return count
+
+    # Returns how many samples were read into the beginning of out
+    def read(self, out: np.ndarray) -> int:
+        with self._lock:
+            count = min(len(out), self._count)
+            first = min(count, self.capacity - self._read_index)
+            out[:first] = self._buffer[self._read_index : self._read_index + first]
+            out[first:count] = self._buffer[: count - first]
+            self._read_index = (self._read_index + count) % self.capacity
+            self._count -= count
+        return count
@@ -5,6 +5,7 @@
 from dataclasses import dataclass, field
 
 from toan.model.presets import ModelConfigPreset
+from toan.training.device_torch import TorchDeviceType
 from toan.training.loss import LossFunction
 
 
@@ -38,6 +39,19 @@ class TrainingConfig:
     compile_model: bool = False
     final_output_steps: int = 120
     final_output_num: int = 4
+    device: TorchDeviceType = TorchDeviceType.Auto
+    # Thread counts of 0 keep the torch defaults
+    cpu_threads_intra: int = 0
+    cpu_threads_inter: int = 0
+    # Only used when training on the cpu
+    cpu_autocast_bf16: bool = False
+    # Number of batches built ahead on a background thread, 0 disables prefetching
+    prefetch_depth: int = 2
+    # Output samples per forward pass when measuring test loss, 0 runs the whole
+    # test signal at once
+    test_chunk_size: int = 0
+    # Run all submodels as one grouped-convolution model when their layouts allow it
+    fuse_submodels: bool = False
 
     def steps_total(self) -> int:
         total = 0
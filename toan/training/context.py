@@ -10,6 +10,7 @@ from toan.model.metadata import ModelGenericMetadata
 from toan.model.nam_a2_wavenet_config import NamA2WaveNetContainerConfig
 from toan.model.nam_a2_wavenet_torch import NamA2WaveNetTorch
 from toan.training import TrainingStageSummary
+from toan.training.data_loader import WindowPeakCache
 
 
 class TrainingProgressContext:
@@ -24,11 +25,15 @@ class TrainingProgressContext:
 
     signal_wet_sweep: np.ndarray | None = None
 
+    # Window peaks of signal_dry_train, kept between stages and training runs
+    window_peak_cache: WindowPeakCache | None = None
+
     lock: threading.Lock = threading.Lock()
     iters_done: int = 0
     iters_total: int = 1
     loss_train: float | None = None
     loss_test: float | None = None
+    steps_per_second: float | None = None
 
     model: NamA2WaveNetTorch | None = None
     summary: TrainingStageSummary | None = None
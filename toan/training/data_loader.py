@@ -2,8 +2,73 @@
 # https://www.gnu.org/licenses/gpl-3.0.en.html
 # SPDX-License-Identifier: GPL-3.0-only
 
+import hashlib
+from dataclasses import dataclass, field
+
 import numpy as np
 
+_SILENCE_THRESHOLD = 1e-4
+
+# Samples hashed to tell whether a cached signal has been written to
+_FINGERPRINT_SAMPLES = 4096
+
+
+def _scan_window_peaks(
+    signal: np.ndarray, dry_width: int, wet_width: int
+) -> tuple[np.ndarray, np.ndarray]:
+    # Windows begin every wet_width samples from offsets 0 and wet_width // 2,
+    # stopping so each window ends before the last sample
+    last_begin = len(signal) - dry_width
+    begin_points = np.concatenate(
+        [
+            np.arange(0, last_begin, wet_width, dtype=np.int64),
+            np.arange(wet_width // 2, last_begin, wet_width, dtype=np.int64),
+        ]
+    )
+    if len(begin_points) == 0:
+        return begin_points, np.zeros(0, dtype=signal.dtype)
+    # Interleave begin and end indices, the even reductions are the windows
+    bounds = np.empty(len(begin_points) * 2, dtype=np.int64)
+    bounds[0::2] = begin_points
+    bounds[1::2] = begin_points + dry_width
+    peaks = np.maximum.reduceat(np.abs(signal), bounds)[0::2]
+    return begin_points, peaks
+
+
+def _fingerprint_signal(signal: np.ndarray) -> bytes:
+    step = max(len(signal) // _FINGERPRINT_SAMPLES, 1)
+    samples = np.ascontiguousarray(signal[::step])
+    return hashlib.sha1(samples.tobytes()).digest() + len(signal).to_bytes(8, "little")
+
+
+@dataclass
+class WindowPeakCache:
+    # Window peaks of one signal so later stages and repeated training runs on the
+    # same recording skip the scan, owned by whoever owns the signal. Assigning a
+    # different array clears it. Only about 4096 evenly spaced samples and the
+    # length are hashed, hashing all of them costs about as much as the scan, so
+    # an edit in place is only noticed if it touches one of those samples
+    signal: np.ndarray | None = None
+    fingerprint: bytes = b""
+    peaks: dict[tuple[int, int], tuple[np.ndarray, np.ndarray]] = field(
+        default_factory=dict
+    )
+
+    def get_window_peaks(
+        self, signal: np.ndarray, dry_width: int, wet_width: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        fingerprint = _fingerprint_signal(signal)
+        if self.signal is not signal or self.fingerprint != fingerprint:
+            self.signal = signal
+            self.fingerprint = fingerprint
+            self.peaks = {}
+        key = (dry_width, wet_width)
+        result = self.peaks.get(key)
+        if result is None:
+            result = _scan_window_peaks(signal, dry_width, wet_width)
+            self.peaks[key] = result
+        return result
+
 
 class TrainingDataLoaderMlx:
     signal_dry: np.ndarray
@@ -13,9 +78,17 @@ class TrainingDataLoaderMlx:
     wet_width: int
     receptive_field: int
 
-    dry_begin_points: list[int]
+    dry_begin_points: np.ndarray
+
+    rng: np.random.Generator | None
+
+    # Begin points in the order they will be used for the current epoch
+    epoch_order: np.ndarray
+    epoch_position: int
 
-    remaining_begin_points: list[int]
+    # Batches are gathered into these and reused between calls
+    batch_buffer_in: np.ndarray
+    batch_buffer_out: np.ndarray
 
     def __init__(
         self,
@@ -23,50 +96,86 @@ class TrainingDataLoaderMlx:
         signal_wet: np.ndarray,
         dry_width: int,
         receptive_field: int,
+        rng: np.random.Generator | None = None,
+        window_peak_cache: WindowPeakCache | None = None,
     ):
         assert len(signal_dry) == len(signal_wet)
         assert dry_width > receptive_field
-        self.signal_dry = signal_dry
-        self.signal_wet = signal_wet
+        self.signal_dry = np.ascontiguousarray(signal_dry, dtype=np.float32)
+        self.signal_wet = np.ascontiguousarray(signal_wet, dtype=np.float32)
         self.dry_width = dry_width
         self.wet_width = dry_width - receptive_field + 1
         self.receptive_field = receptive_field
-        self.dry_begin_points = []
-        self.remaining_begin_points = []
+        # Without a generator the global numpy random state is used
+        self.rng = rng
+        if window_peak_cache is None:
+            begin_points, peaks = _scan_window_peaks(
+                signal_dry, self.dry_width, self.wet_width
+            )
+        else:
+            begin_points, peaks = window_peak_cache.get_window_peaks(
+                signal_dry, self.dry_width, self.wet_width
+            )
+        self.dry_begin_points = begin_points[peaks > _SILENCE_THRESHOLD]
+        assert len(self.dry_begin_points) > 0
 
-        def dry_begin_from_wet_begin(wet_begin: int) -> int:
-            delta = self.dry_width - self.wet_width
-            result = wet_begin - delta
+        # Strided views where row n is the window beginning at sample n
+        self._dry_windows = np.lib.stride_tricks.sliding_window_view(
+            self.signal_dry, self.dry_width
+        )
+        self._wet_windows = np.lib.stride_tricks.sliding_window_view(
+            self.signal_wet, self.wet_width
+        )
+
+        self.epoch_order = np.zeros(0, dtype=np.int64)
+        self.epoch_position = 0
+        self.batch_buffer_in = np.zeros((0, self.dry_width), dtype=np.float32)
+        self.batch_buffer_out = np.zeros((0, self.wet_width), dtype=np.float32)
+
+    def _take_begin_points(self, count: int) -> np.ndarray:
+        # Every begin point is used once per epoch, a batch may span two epochs
+        remaining = len(self.epoch_order) - self.epoch_position
+        if remaining >= count:
+            result = self.epoch_order[self.epoch_position : self.epoch_position + count]
+            self.epoch_position += count
             return result
+        parts = [self.epoch_order[self.epoch_position :]]
+        needed = count - remaining
+        while needed > 0:
+            if self.rng is None:
+                self.epoch_order = np.random.permutation(self.dry_begin_points)
+            else:
+                self.epoch_order = self.rng.permutation(self.dry_begin_points)
+            self.epoch_position = min(needed, len(self.epoch_order))
+            parts.append(self.epoch_order[: self.epoch_position])
+            needed -= self.epoch_position
+        return np.concatenate(parts)
 
-        # Scan forward from the first valid wet sample
-        def append_to_dry_point_list(offset: int):
-            wet_begin_first = offset + self.dry_width - self.wet_width
-            this_wet_begin = wet_begin_first
-            while this_wet_begin < len(signal_wet) - self.wet_width:
-                dry_begin = dry_begin_from_wet_begin(this_wet_begin)
-                assert dry_begin >= 0
-                assert dry_begin + self.dry_width <= len(signal_dry)
-                this_segment = signal_dry[dry_begin : dry_begin + self.dry_width]
-                if np.max(np.abs(this_segment)).item() > 1e-4:
-                    self.dry_begin_points.append(dry_begin)
-                this_wet_begin += self.wet_width
-
-        append_to_dry_point_list(0)
-        append_to_dry_point_list(self.wet_width // 2)
-
-    def make_batch(self, batch_size: int) -> tuple[np.ndarray, np.ndarray]:
-        input_list: list[mx.array] = []
-        output_list: list[mx.array] = []
-        for i in range(batch_size):
-            if len(self.remaining_begin_points) == 0:
-                self.remaining_begin_points = self.dry_begin_points[:]
-                np.random.shuffle(self.remaining_begin_points)
-            index_begin = np.random.randint(len(self.remaining_begin_points))
-            sample_begin = self.remaining_begin_points.pop(index_begin)
-            sample_end = sample_begin + self.dry_width
-            this_input = self.signal_dry[sample_begin:sample_end]
-            this_output = self.signal_wet[sample_end - self.wet_width : sample_end]
-            input_list.append(this_input)
-            output_list.append(this_output)
-        return np.array(input_list), np.array(output_list)
+    def _ensure_batch_buffers(self, batch_size: int) -> None:
+        if len(self.batch_buffer_in) >= batch_size:
+            return
+        self.batch_buffer_in = np.empty((batch_size, self.dry_width), dtype=np.float32)
+        self.batch_buffer_out = np.empty((batch_size, self.wet_width), dtype=np.float32)
+
+    # Without explicit buffers the returned arrays are views of buffers owned by
+    # this loader, they are overwritten by the next call to make_batch
+    def make_batch(
+        self,
+        batch_size: int,
+        buffer_in: np.ndarray | None = None,
+        buffer_out: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        if buffer_in is None or buffer_out is None:
+            self._ensure_batch_buffers(batch_size)
+            buffer_in = self.batch_buffer_in[:batch_size]
+            buffer_out = self.batch_buffer_out[:batch_size]
+        assert buffer_in.shape == (batch_size, self.dry_width)
+        assert buffer_out.shape == (batch_size, self.wet_width)
+        begin_points = self._take_begin_points(batch_size)
+        # Copied row by row straight into the buffers, fancy indexing would build
+        # a temporary batch and np.take would first copy the whole strided view
+        wet_offset = self.dry_width - self.wet_width
+        for row, begin in enumerate(begin_points.tolist()):
+            buffer_in[row] = self._dry_windows[begin]
+            buffer_out[row] = self._wet_windows[begin + wet_offset]
+        return buffer_in, buffer_out
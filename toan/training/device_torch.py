@@ -0,0 +1,75 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import enum
+
+import torch
+
+
+class TorchDeviceType(enum.Enum):
+    Auto = enum.auto()
+    Cpu = enum.auto()
+    Cuda = enum.auto()
+    Mps = enum.auto()
+
+    def get_label(self) -> str:
+        match self:
+            case TorchDeviceType.Auto:
+                return "auto"
+            case TorchDeviceType.Cpu:
+                return "cpu"
+            case TorchDeviceType.Cuda:
+                return "cuda"
+            case TorchDeviceType.Mps:
+                return "mps"
+            case _:
+                raise NotImplementedError
+
+    @classmethod
+    def from_label(cls, label: str) -> "TorchDeviceType":
+        for device_type in cls:
+            if device_type.get_label() == label.lower():
+                return device_type
+        raise ValueError(f"Unknown device: {label}")
+
+
+def _detect_torch_device() -> torch.device:
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    if torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+
+def get_torch_device(
+    device_type: TorchDeviceType = TorchDeviceType.Auto,
+) -> torch.device:
+    match device_type:
+        case TorchDeviceType.Auto:
+            return _detect_torch_device()
+        case TorchDeviceType.Cpu:
+            return torch.device("cpu")
+        case TorchDeviceType.Cuda:
+            if not torch.cuda.is_available():
+                raise RuntimeError("CUDA device requested but not available")
+            return torch.device("cuda")
+        case TorchDeviceType.Mps:
+            if not torch.backends.mps.is_available():
+                raise RuntimeError("MPS device requested but not available")
+            return torch.device("mps")
+        case _:
+            raise NotImplementedError
+
+
+def configure_cpu_threads(intra_op_threads: int, inter_op_threads: int) -> None:
+    # A count of 0 leaves the torch default in place
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads > 0 and torch.get_num_interop_threads() != inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # Torch only allows this before any inter-op work has started,
+            # later training runs in the same process keep the first value
+            pass
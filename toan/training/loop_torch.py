@@ -2,7 +2,9 @@
 # https://www.gnu.org/licenses/gpl-3.0.en.html
 # SPDX-License-Identifier: GPL-3.0-only
 
+import contextlib
 import math
+import time
 
 import numpy as np
 import torch
@@ -10,13 +12,20 @@ from torch import optim
 
 from toan.model.metadata import ModelA2Metadata
 from toan.model.nam_a2_wavenet_config import NamA2WaveNetContainerConfig
+from toan.model.nam_a2_wavenet_render_torch import forward_chunked
 from toan.model.nam_a2_wavenet_torch import NamA2WaveNetTorch
 from toan.training import TrainingStageSummary
 from toan.training.config import TrainingConfig, TrainingStageConfig
 from toan.training.context import TrainingProgressContext
-from toan.training.data_loader import TrainingDataLoaderMlx
+from toan.training.data_loader import TrainingDataLoaderMlx, WindowPeakCache
+from toan.training.device_torch import configure_cpu_threads, get_torch_device
 from toan.training.loss import LossFunction
-from toan.training.loss_torch import calculate_loss_torch
+from toan.training.loss_torch import (
+    LossTarget,
+    calculate_loss_torch,
+    calculate_losses_torch,
+)
+from toan.training.prefetch_torch import TrainingBatchPrefetcher
 
 
 # Get the specific samples that will produce candidate models
@@ -35,19 +44,26 @@ def _final_output_sample_steps(
     return steps
 
 
+def _split_submodel_outputs(model_output: torch.Tensor) -> list[torch.Tensor]:
+    if model_output.ndim == 3:
+        return [model_output[i] for i in range(model_output.shape[0])]
+    return [model_output]
+
+
 def _calculate_submodel_losses(
     loss_fn: LossFunction,
     model_output: torch.Tensor,
-    target: torch.Tensor,
+    target: torch.Tensor | LossTarget,
 ) -> list[torch.Tensor]:
     # A2 models stack one prediction per submodel as (num_submodels, batch, length),
     # so report each submodel's own loss. A non-stacked 2D output is a single submodel.
-    if model_output.ndim == 3:
-        return [
-            calculate_loss_torch(loss_fn, model_output[i], target)
-            for i in range(model_output.shape[0])
-        ]
-    return [calculate_loss_torch(loss_fn, model_output, target)]
+    # Every submodel is compared against the same target spectra.
+    if not isinstance(target, LossTarget):
+        target = LossTarget(target)
+    return [
+        calculate_loss_torch(loss_fn, submodel_output, target)
+        for submodel_output in _split_submodel_outputs(model_output)
+    ]
 
 
 def _calculate_model_loss(
@@ -76,11 +92,25 @@ def run_training_loop_torch(context: TrainingProgressContext, config: TrainingCo
         )
     else:
         raise NotImplementedError("Only NAM A2 is supported.")
-    device = torch.device("mps")
+    device = get_torch_device(config.device)
+    if device.type == "cpu":
+        configure_cpu_threads(config.cpu_threads_intra, config.cpu_threads_inter)
     model.to(device)
+    model.fused = config.fuse_submodels and model.can_fuse()
+
+    use_bf16_autocast = device.type == "cpu" and config.cpu_autocast_bf16
+
+    def forward_context():
+        if use_bf16_autocast:
+            return torch.autocast(device_type="cpu", dtype=torch.bfloat16)
+        return contextlib.nullcontext()
 
     np_rng_state = np.random.get_state()
     np.random.seed(config.rng_seed)
+    # Batches are sampled on the prefetch thread, so they use their own generator
+    data_rng = np.random.default_rng(config.rng_seed)
+    if context.window_peak_cache is None:
+        context.window_peak_cache = WindowPeakCache()
 
     def get_batch_size(stage_cfg: TrainingStageConfig, iter: int) -> int:
         if stage_cfg.batch_size > 0:
@@ -117,42 +147,56 @@ def run_training_loop_torch(context: TrainingProgressContext, config: TrainingCo
 
         return lr_lambda
 
-    def get_test_data() -> tuple[torch.Tensor, torch.Tensor]:
-        input = (
-            torch.from_numpy(context.signal_dry_test.copy())
-            .float()
-            .reshape((1, -1))
-            .to(device)
-        )
-        output = (
-            torch.from_numpy(context.signal_wet_test.copy())
-            .float()[model.receptive_field - 1 :]
-            .reshape((1, -1))
-            .to(device)
-        )
-        return input, output
-
-    def measure_test_loss_per_submodel(
-        func: LossFunction,
-    ) -> tuple[float, list[float]]:
+    # Test signals are uploaded once and stay on the device for the whole run, the
+    # target spectra are computed on the first test and kept with them
+    test_data: tuple[torch.Tensor, LossTarget] | None = None
+
+    def get_test_data() -> tuple[torch.Tensor, LossTarget]:
+        nonlocal test_data
+        if test_data is None:
+            input = (
+                torch.from_numpy(np.array(context.signal_dry_test, dtype=np.float32))
+                .reshape((1, -1))
+                .to(device)
+            )
+            output = (
+                torch.from_numpy(np.array(context.signal_wet_test, dtype=np.float32))[
+                    model.receptive_field - 1 :
+                ]
+                .reshape((1, -1))
+                .to(device)
+            )
+            test_data = (input, LossTarget(output))
+        return test_data
+
+    def measure_test_losses_per_submodel(
+        funcs: list[LossFunction],
+    ) -> dict[LossFunction, list[float]]:
+        # One forward pass over the test signal scores every requested loss
         model.train(False)
         test_in, test_out = get_test_data()
+        result: dict[LossFunction, list[float]] = {func: [] for func in funcs}
         with torch.no_grad():
-            model_out = model(test_in)
-            per_submodel = [
-                loss.item()
-                for loss in _calculate_submodel_losses(func, model_out, test_out)
-            ]
-        return sum(per_submodel), per_submodel
-
-    def measure_test_loss(func: LossFunction) -> float:
-        return measure_test_loss_per_submodel(func)[0]
+            model_out = forward_chunked(
+                model, test_in, model.receptive_field, config.test_chunk_size
+            )
+            for submodel_out in _split_submodel_outputs(model_out):
+                losses = calculate_losses_torch(funcs, submodel_out, test_out)
+                values = torch.stack([losses[func] for func in funcs]).tolist()
+                for func, value in zip(funcs, values):
+                    result[func].append(value)
+        return result
 
-    def export_model_weights():
-        return [submodel.export_nam_linear_weights() for submodel in model.submodels]
+    # Candidate weights stay on the device as tensors, they are only flattened to
+    # the nam list when the model is exported
+    def export_submodel_weights(index: int) -> dict[str, torch.Tensor]:
+        return {
+            name: tensor.detach().clone()
+            for name, tensor in model.submodels[index].state_dict().items()
+        }
 
-    def restore_model_weights(weights) -> None:
-        model.import_nam_linear_weights(weights)
+    def restore_submodel_weights(index: int, weights: dict[str, torch.Tensor]) -> None:
+        model.submodels[index].load_state_dict(weights)
 
     with context.lock:
         context.iters_done = 0
@@ -165,7 +209,7 @@ def run_training_loop_torch(context: TrainingProgressContext, config: TrainingCo
     final_stage_loss_fn = config.stages[-1].loss_fn
     num_submodels = len(model.submodels)
     best_submodel_losses: list[float] = [math.inf] * num_submodels
-    best_submodel_weights: list[list[float] | None] = [None] * num_submodels
+    best_submodel_weights: list[dict[str, torch.Tensor] | None] = [None] * num_submodels
     steps_before_stage = 0
 
     for stage_config in config.stages:
@@ -180,6 +224,17 @@ def run_training_loop_torch(context: TrainingProgressContext, config: TrainingCo
             context.signal_wet_train,
             stage_config.input_sample_width,
             model.receptive_field,
+            rng=data_rng,
+            window_peak_cache=context.window_peak_cache,
+        )
+        prefetcher = TrainingBatchPrefetcher(
+            data_loader,
+            [
+                get_batch_size(stage_config, i)
+                for i in range(stage_config.steps_total())
+            ],
+            config.prefetch_depth,
+            pin_memory=device.type == "cuda",
         )
 
         optimizer = optim.AdamW(
@@ -196,7 +251,10 @@ def run_training_loop_torch(context: TrainingProgressContext, config: TrainingCo
             batch_in_step: torch.Tensor, batch_out_step: torch.Tensor
         ) -> torch.Tensor:
             optimizer.zero_grad()
-            outputs = model(batch_in_step)
+            with forward_context():
+                outputs = model(batch_in_step)
+            # Losses are always computed at full precision
+            outputs = outputs.float()
             loss = _calculate_model_loss(stage_config.loss_fn, outputs, batch_out_step)
             loss.backward()
             optimizer.step()
@@ -209,65 +267,82 @@ def run_training_loop_torch(context: TrainingProgressContext, config: TrainingCo
         train_loss_buffer = torch.ones(12)
         train_loss_buffer_sz = train_loss_buffer.numel()
 
-        for i in range(stage_config.steps_total()):
-            if context.quit:
-                return
-            model.train(True)
-            this_batch_size = get_batch_size(stage_config, i)
-            batch_in_np, batch_out_np = data_loader.make_batch(this_batch_size)
-            batch_in = torch.from_numpy(batch_in_np).float().to(device)
-            batch_out = torch.from_numpy(batch_out_np).float().to(device)
-
-            loss = do_step(batch_in, batch_out)
-
-            train_loss_buffer[i % train_loss_buffer_sz] = loss.detach()
-
-            summary.losses_train.append(loss.item())
-
-            with context.lock:
-                context.iters_done = i
-                context.loss_train = train_loss_buffer.mean().item()
-
-                if (
-                    context.signal_dry_test is not None
-                    and stage_config.test_interval > 0
-                ):
-                    if i % stage_config.test_interval == stage_config.test_interval - 1:
-                        loss_test = measure_test_loss(stage_config.loss_fn)
+        prefetcher.start()
+        try:
+            stage_time_begin = time.perf_counter()
+            for i in range(stage_config.steps_total()):
+                if context.quit:
+                    return
+                model.train(True)
+                batch_in_host, batch_out_host = prefetcher.next_batch()
+                batch_in = batch_in_host.to(device, non_blocking=True)
+                batch_out = batch_out_host.to(device, non_blocking=True)
+
+                loss = do_step(batch_in, batch_out)
+
+                train_loss_buffer[i % train_loss_buffer_sz] = loss.detach()
+
+                summary.losses_train.append(loss.item())
+
+                stage_time_elapsed = time.perf_counter() - stage_time_begin
+
+                with context.lock:
+                    context.iters_done = i
+                    context.loss_train = train_loss_buffer.mean().item()
+                    if stage_time_elapsed > 0.0:
+                        context.steps_per_second = (i + 1) / stage_time_elapsed
+
+                    # Periodic tests and candidates for the final output share
+                    # a single pass over the test signal when they coincide
+                    is_test_step = (
+                        stage_config.test_interval > 0
+                        and i % stage_config.test_interval
+                        == stage_config.test_interval - 1
+                    )
+                    global_step = steps_before_stage + i
+                    is_candidate_step = global_step in final_sample_steps
+                    step_test_losses: dict[LossFunction, list[float]] = {}
+                    if context.signal_dry_test is not None and (
+                        is_test_step or is_candidate_step
+                    ):
+                        step_test_funcs = []
+                        if is_test_step:
+                            step_test_funcs.append(stage_config.loss_fn)
+                        if is_candidate_step:
+                            step_test_funcs.append(final_stage_loss_fn)
+                        step_test_losses = measure_test_losses_per_submodel(
+                            list(dict.fromkeys(step_test_funcs))
+                        )
+
+                    if is_test_step and stage_config.loss_fn in step_test_losses:
+                        loss_test = sum(step_test_losses[stage_config.loss_fn])
                         summary.losses_test.append(loss_test)
                         context.loss_test = loss_test
 
-                # Check if this step is a candidate for the final output
-                # and measure all submodels if it is
-                global_step = steps_before_stage + i
-                if (
-                    context.signal_dry_test is not None
-                    and global_step in final_sample_steps
-                ):
-                    _, per_submodel_losses = measure_test_loss_per_submodel(
-                        final_stage_loss_fn
-                    )
-                    current_weights = export_model_weights()
-                    for idx, submodel_loss in enumerate(per_submodel_losses):
-                        if submodel_loss < best_submodel_losses[idx]:
-                            best_submodel_losses[idx] = submodel_loss
-                            best_submodel_weights[idx] = current_weights[idx]
+                    # Keep the best weights of each submodel over the candidates
+                    if is_candidate_step and final_stage_loss_fn in step_test_losses:
+                        per_submodel_losses = step_test_losses[final_stage_loss_fn]
+                        for idx, submodel_loss in enumerate(per_submodel_losses):
+                            if submodel_loss < best_submodel_losses[idx]:
+                                best_submodel_losses[idx] = submodel_loss
+                                best_submodel_weights[idx] = export_submodel_weights(
+                                    idx
+                                )
+        finally:
+            prefetcher.close()
 
         steps_before_stage += stage_config.steps_total()
 
     # Create a new model from the best-scoring weights of each submodel
-    if any(weights is not None for weights in best_submodel_weights):
-        recombined_weights = export_model_weights()
-        for idx, weights in enumerate(best_submodel_weights):
-            if weights is not None:
-                recombined_weights[idx] = weights
-        restore_model_weights(recombined_weights)
+    for idx, weights in enumerate(best_submodel_weights):
+        if weights is not None:
+            restore_submodel_weights(idx, weights)
 
     if context.signal_dry_test is not None:
         submodel_loss_tests: list[dict[str, float]] = [{} for _ in range(num_submodels)]
-        for this_loss in LossFunction:
-            full_loss, per_submodel = measure_test_loss_per_submodel(this_loss)
-            context.metadata.loss_test[this_loss.name] = full_loss
+        all_losses = measure_test_losses_per_submodel(list(LossFunction))
+        for this_loss, per_submodel in all_losses.items():
+            context.metadata.loss_test[this_loss.name] = sum(per_submodel)
             for submodel_dict, submodel_loss in zip(submodel_loss_tests, per_submodel):
                 submodel_dict[this_loss.name] = submodel_loss
 
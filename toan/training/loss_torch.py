@@ -6,22 +6,13 @@
 # the Apache 2 license.
 
 import warnings
+from dataclasses import dataclass
 
 import torch
 
 from toan.training.loss import LossFunction
 
 
-def _loss_esr_torch(output: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
-    eps = 1e-6
-    delta2 = (target - output) ** 2
-    target2 = target**2
-    delta2_mean = delta2.mean(dim=-1)
-    target2_mean = target2.mean(dim=-1)
-    loss_per_batch_item = delta2_mean / (target2_mean + eps)
-    return loss_per_batch_item.mean()
-
-
 def _loss_mse_torch(output: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
     delta = target - output
     delta2 = delta**2
@@ -32,14 +23,10 @@ def _loss_rmse_torch(output: torch.Tensor, target: torch.Tensor) -> torch.Tensor
     return torch.sqrt(_loss_mse_torch(output, target))
 
 
-def _loss_fft_mse_torch(output: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+def _rfft_torch(x: torch.Tensor) -> torch.Tensor:
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", message=".*was resized since it had shape.*")
-        output_fft = torch.fft.rfft(output.contiguous())
-        target_fft = torch.fft.rfft(target.contiguous())
-    delta = target_fft - output_fft
-    delta2 = delta.abs() ** 2
-    return delta2.mean()
+        return torch.fft.rfft(x.contiguous())
 
 
 # Multi-resolution STFT parameters matching auraloss
@@ -66,10 +53,10 @@ def _get_hann_window(
     return window
 
 
-def _stft_magnitude(
+def _stft_magnitudes(
     x: torch.Tensor, fft_size: int, hop_size: int, win_length: int
-) -> torch.Tensor:
-    # x: (B, L) -> magnitude spectrogram (B, freq, frames)
+) -> tuple[torch.Tensor, torch.Tensor]:
+    # x: (B, L) -> magnitude and log-magnitude spectrograms (B, freq, frames)
     window = _get_hann_window(win_length, x.device, x.dtype)
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", message=".*was resized since it had shape.*")
@@ -81,46 +68,169 @@ def _stft_magnitude(
             window,
             return_complex=True,
         )
-    return torch.sqrt(torch.clamp(x_stft.real**2 + x_stft.imag**2, min=_MRSTFT_EPS))
+    magnitude = torch.sqrt(
+        torch.clamp(x_stft.real.square() + x_stft.imag.square(), min=_MRSTFT_EPS)
+    )
+    return magnitude, torch.log(magnitude)
+
+
+@dataclass
+class _StftTargetSpectra:
+    magnitude: torch.Tensor
+    log_magnitude: torch.Tensor
+    magnitude_norm: torch.Tensor
+
+
+class LossTarget:
+    # A target signal whose spectra are computed on first use, reuse one instance
+    # for every submodel of a step and every test against the same signal
+    signal: torch.Tensor
+    _mean_square: torch.Tensor | None
+    _fft: torch.Tensor | None
+    _mrstft_spectra: list[_StftTargetSpectra] | None
+
+    def __init__(self, signal: torch.Tensor):
+        self.signal = signal
+        self._mean_square = None
+        self._fft = None
+        self._mrstft_spectra = None
+
+    def get_mean_square(self) -> torch.Tensor:
+        if self._mean_square is None:
+            self._mean_square = (self.signal**2).mean(dim=-1)
+        return self._mean_square
+
+    def get_fft(self) -> torch.Tensor:
+        if self._fft is None:
+            with torch.no_grad():
+                self._fft = _rfft_torch(self.signal)
+        return self._fft
+
+    def get_mrstft_spectra(self) -> list[_StftTargetSpectra]:
+        if self._mrstft_spectra is None:
+            self._mrstft_spectra = []
+            with torch.no_grad():
+                for fft_size, hop_size, win_length in zip(
+                    _MRSTFT_FFT_SIZES, _MRSTFT_HOP_SIZES, _MRSTFT_WIN_LENGTHS
+                ):
+                    magnitude, log_magnitude = _stft_magnitudes(
+                        self.signal, fft_size, hop_size, win_length
+                    )
+                    self._mrstft_spectra.append(
+                        _StftTargetSpectra(
+                            magnitude,
+                            log_magnitude,
+                            torch.linalg.vector_norm(magnitude),
+                        )
+                    )
+        return self._mrstft_spectra
+
+
+def calculate_mrstft_terms_torch(
+    output: torch.Tensor, target: torch.Tensor | LossTarget
+) -> list[tuple[torch.Tensor, torch.Tensor]]:
+    # Spectral convergence and log-magnitude terms for each resolution
+    if not isinstance(target, LossTarget):
+        target = LossTarget(target)
+    terms = []
+    for target_spectra, fft_size, hop_size, win_length in zip(
+        target.get_mrstft_spectra(),
+        _MRSTFT_FFT_SIZES,
+        _MRSTFT_HOP_SIZES,
+        _MRSTFT_WIN_LENGTHS,
+    ):
+        x_mag, x_log_mag = _stft_magnitudes(output, fft_size, hop_size, win_length)
+        # Spectral convergence (Frobenius norm over the whole tensor)
+        sc_loss = (
+            torch.linalg.vector_norm(target_spectra.magnitude - x_mag)
+            / target_spectra.magnitude_norm
+        )
+        # Log-magnitude L1 distance
+        log_mag_loss = torch.nn.functional.l1_loss(
+            x_log_mag, target_spectra.log_magnitude
+        )
+        terms.append((sc_loss, log_mag_loss))
+    return terms
+
+
+def _loss_esr_torch(output: torch.Tensor, target: LossTarget) -> torch.Tensor:
+    eps = 1e-6
+    delta2 = (target.signal - output) ** 2
+    delta2_mean = delta2.mean(dim=-1)
+    loss_per_batch_item = delta2_mean / (target.get_mean_square() + eps)
+    return loss_per_batch_item.mean()
+
+
+def _loss_fft_mse_torch(output: torch.Tensor, target: LossTarget) -> torch.Tensor:
+    delta = target.get_fft() - _rfft_torch(output)
+    delta2 = delta.abs() ** 2
+    return delta2.mean()
 
 
 # MRSTFT implementation matching auraloss
-def _loss_mrstft_torch(output: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+def _loss_mrstft_torch(output: torch.Tensor, target: LossTarget) -> torch.Tensor:
     total = output.new_zeros(())
-    for fft_size, hop_size, win_length in zip(
-        _MRSTFT_FFT_SIZES, _MRSTFT_HOP_SIZES, _MRSTFT_WIN_LENGTHS
-    ):
-        x_mag = _stft_magnitude(output, fft_size, hop_size, win_length)
-        y_mag = _stft_magnitude(target, fft_size, hop_size, win_length)
-        # Spectral convergence (Frobenius norm over the whole tensor)
-        sc_loss = torch.norm(y_mag - x_mag, p="fro") / torch.norm(y_mag, p="fro")
-        # Log-magnitude L1 distance
-        log_mag_loss = torch.nn.functional.l1_loss(torch.log(x_mag), torch.log(y_mag))
+    for sc_loss, log_mag_loss in calculate_mrstft_terms_torch(output, target):
         total = total + sc_loss + log_mag_loss
     return total / len(_MRSTFT_FFT_SIZES)
 
 
-def _loss_nam_original_torch(
-    output: torch.Tensor, target: torch.Tensor
-) -> torch.Tensor:
+def _loss_nam_original_torch(output: torch.Tensor, target: LossTarget) -> torch.Tensor:
     return _NAM_MSE_WEIGHT * _loss_mse_torch(
-        output, target
+        output, target.signal
     ) + _NAM_MRSTFT_WEIGHT * _loss_mrstft_torch(output, target)
 
 
 def calculate_loss_torch(
-    loss_fn: LossFunction, model_output: torch.Tensor, target: torch.Tensor
+    loss_fn: LossFunction,
+    model_output: torch.Tensor,
+    target: torch.Tensor | LossTarget,
 ) -> torch.Tensor:
+    if isinstance(target, LossTarget):
+        loss_target = target
+        target = target.signal
+    else:
+        loss_target = LossTarget(target)
     match loss_fn:
         case LossFunction.ESR:
-            return _loss_esr_torch(model_output, target)
+            return _loss_esr_torch(model_output, loss_target)
         case LossFunction.MSE:
             return _loss_mse_torch(model_output, target)
         case LossFunction.RMSE:
             return _loss_rmse_torch(model_output, target)
         case LossFunction.FFT_MSE:
-            return _loss_fft_mse_torch(model_output, target)
+            return _loss_fft_mse_torch(model_output, loss_target)
         case LossFunction.NamOriginal:
-            return _loss_nam_original_torch(model_output, target)
+            return _loss_nam_original_torch(model_output, loss_target)
         case _:
             assert False
+
+
+def calculate_losses_torch(
+    loss_fns: list[LossFunction],
+    model_output: torch.Tensor,
+    target: torch.Tensor | LossTarget,
+) -> dict[LossFunction, torch.Tensor]:
+    # Every requested loss from one output, sharing the mean squared error and the
+    # cached target values between them
+    if not isinstance(target, LossTarget):
+        target = LossTarget(target)
+    mse = _loss_mse_torch(model_output, target.signal)
+    result: dict[LossFunction, torch.Tensor] = {}
+    for loss_fn in loss_fns:
+        match loss_fn:
+            case LossFunction.ESR:
+                result[loss_fn] = _loss_esr_torch(model_output, target)
+            case LossFunction.MSE:
+                result[loss_fn] = mse
+            case LossFunction.RMSE:
+                result[loss_fn] = torch.sqrt(mse)
+            case LossFunction.FFT_MSE:
+                result[loss_fn] = _loss_fft_mse_torch(model_output, target)
+            case LossFunction.NamOriginal:
+                result[loss_fn] = _NAM_MSE_WEIGHT * mse + _NAM_MRSTFT_WEIGHT * (
+                    _loss_mrstft_torch(model_output, target)
+                )
+            case _:
+                assert False
+    return result
@@ -0,0 +1,124 @@
+# This file is part of Toan Machine and is licensed under the GPLv3
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+# SPDX-License-Identifier: GPL-3.0-only
+
+import queue
+import threading
+
+import torch
+
+from toan.training.data_loader import TrainingDataLoaderMlx
+
+
+class TrainingBatchPrefetcher:
+    data_loader: TrainingDataLoaderMlx
+    batch_sizes: list[int]
+    depth: int
+
+    # Ring of staging buffers, one slot is held by the consumer at a time
+    slots_in: list[torch.Tensor]
+    slots_out: list[torch.Tensor]
+
+    _free_slots: queue.Queue
+    _ready_slots: queue.Queue
+    _held_slot: int | None
+    _next_index: int
+    _stop: threading.Event
+    _thread: threading.Thread | None
+
+    # Batches are produced in the order of batch_sizes, one per entry. With a depth
+    # of 0 every batch is built synchronously when requested.
+    def __init__(
+        self,
+        data_loader: TrainingDataLoaderMlx,
+        batch_sizes: list[int],
+        depth: int,
+        pin_memory: bool = False,
+    ):
+        assert depth >= 0
+        self.data_loader = data_loader
+        self.batch_sizes = batch_sizes
+        self.depth = depth
+
+        max_batch_size = max(batch_sizes, default=1)
+        self.slots_in = []
+        self.slots_out = []
+        for _ in range(depth + 1):
+            self.slots_in.append(
+                torch.empty(
+                    (max_batch_size, data_loader.dry_width),
+                    dtype=torch.float32,
+                    pin_memory=pin_memory,
+                )
+            )
+            self.slots_out.append(
+                torch.empty(
+                    (max_batch_size, data_loader.wet_width),
+                    dtype=torch.float32,
+                    pin_memory=pin_memory,
+                )
+            )
+
+        self._free_slots = queue.Queue()
+        for slot in range(depth + 1):
+            self._free_slots.put(slot)
+        self._ready_slots = queue.Queue()
+        self._held_slot = None
+        self._next_index = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self.depth == 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # The returned tensors are valid until the next call to next_batch
+    def next_batch(self) -> tuple[torch.Tensor, torch.Tensor]:
+        if self._held_slot is not None:
+            self._free_slots.put(self._held_slot)
+            self._held_slot = None
+
+        assert self._next_index < len(self.batch_sizes)
+        batch_size = self.batch_sizes[self._next_index]
+        self._next_index += 1
+
+        if self.depth == 0:
+            slot = self._free_slots.get()
+            self._fill_slot(slot, batch_size)
+        else:
+            slot = self._ready_slots.get()
+            if isinstance(slot, BaseException):
+                raise slot
+        self._held_slot = slot
+        return self.slots_in[slot][:batch_size], self.slots_out[slot][:batch_size]
+
+    def _fill_slot(self, slot: int, batch_size: int) -> None:
+        self.data_loader.make_batch(
+            batch_size,
+            self.slots_in[slot][:batch_size].numpy(),
+            self.slots_out[slot][:batch_size].numpy(),
+        )
+
+    def _produce(self) -> None:
+        try:
+            for batch_size in self.batch_sizes:
+                slot = None
+                while slot is None:
+                    if self._stop.is_set():
+                        return
+                    try:
+                        slot = self._free_slots.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                self._fill_slot(slot, batch_size)
+                self._ready_slots.put(slot)
+        except BaseException as e:
+            self._ready_slots.put(e)
@@ -11,6 +11,8 @@ import numpy as np
 from scipy.io import wavfile
 
 from toan.model.metadata import ModelGenericMetadata
+from toan.persistence.zip_cache import extract_zip_member_cached
+from toan.signal.align import SignalAlignment, align_wet_signal, estimate_alignment
 from toan.signal.analysis import find_dry_clicks, find_wet_clicks
 
 
@@ -25,6 +27,7 @@ class ZipLoaderContext:
     signal_wet_test: np.ndarray | None = None
     signal_wet_sweep: np.ndarray | None = None
     metadata: ModelGenericMetadata | None = None
+    alignment: SignalAlignment | None = None
     sample_rate: int = 0
 
     complete: bool = False
@@ -35,7 +38,23 @@ class ZipLoaderContext:
         self.messages_queue = []
 
 
-def run_zip_loader(context: ZipLoaderContext, input_file: str | io.BytesIO):
+def _read_zip_wav(
+    zip_file: zipfile.ZipFile, input_file: str | io.BytesIO, member: str
+) -> tuple[int, np.ndarray]:
+    # Archives on disk have their members extracted to the cache once and then
+    # memory-mapped, in-memory archives are decoded from a copy of the member
+    if isinstance(input_file, str):
+        cache_path = extract_zip_member_cached(zip_file, input_file, member)
+        return wavfile.read(cache_path, mmap=True)
+    with io.BytesIO(zip_file.read(member)) as member_bytes_io:
+        return wavfile.read(member_bytes_io)
+
+
+def run_zip_loader(
+    context: ZipLoaderContext,
+    input_file: str | io.BytesIO,
+    fine_alignment: bool = True,
+):
     def print_status(message: str):
         with context.messages_lock:
             context.messages_queue.append(message)
@@ -189,12 +208,12 @@ def run_zip_loader(context: ZipLoaderContext, input_file: str | io.BytesIO):
 
             try:
                 print_status(f"Loading dry signal: {config_json["dry_signal"]}")
-                dry_signal_bytes = zip_file.read(config_json["dry_signal"])
-                with io.BytesIO(dry_signal_bytes) as dry_bytes_io:
-                    dry_sample_rate, dry_signal = wavfile.read(dry_bytes_io)
-                    if dry_sample_rate != config_json["sample_rate"]:
-                        print_status("Error: dry signal has unexpected sample rate")
-                        return
+                dry_sample_rate, dry_signal = _read_zip_wav(
+                    zip_file, input_file, config_json["dry_signal"]
+                )
+                if dry_sample_rate != config_json["sample_rate"]:
+                    print_status("Error: dry signal has unexpected sample rate")
+                    return
             except:
                 print_status(
                     f"Error: Failed to load dry signal from {config_json["dry_signal"]}"
@@ -203,12 +222,12 @@ def run_zip_loader(context: ZipLoaderContext, input_file: str | io.BytesIO):
 
             try:
                 print_status(f"Loading wet signal: {config_json["wet_signal"]}")
-                wet_signal_bytes = zip_file.read(config_json["wet_signal"])
-                with io.BytesIO(wet_signal_bytes) as wet_bytes_io:
-                    wet_sample_rate, wet_signal = wavfile.read(wet_bytes_io)
-                    if wet_sample_rate != config_json["sample_rate"]:
-                        print_status("Error: wet signal has unexpected sample rate")
-                        return
+                wet_sample_rate, wet_signal = _read_zip_wav(
+                    zip_file, input_file, config_json["wet_signal"]
+                )
+                if wet_sample_rate != config_json["sample_rate"]:
+                    print_status("Error: wet signal has unexpected sample rate")
+                    return
             except:
                 print_status(
                     f"Error: Failed to load wet signal from {config_json["wet_signal"]}"
@@ -247,16 +266,30 @@ def run_zip_loader(context: ZipLoaderContext, input_file: str | io.BytesIO):
             latency_samples = min(latency_samples_a, latency_samples_b)
             print_status(f"Recording latency: {latency_samples} samples")
 
+            # Refine the click latency with sub-sample precision and correct for
+            # clock drift between playback and recording
+            alignment = SignalAlignment(latency=float(latency_samples))
+            if fine_alignment:
+                maybe_alignment = estimate_alignment(
+                    dry_signal,
+                    wet_signal,
+                    latency_samples,
+                    (clicks_begin, clicks_end),
+                    [(sweep_begin, sweep_end), (train_begin, train_end)],
+                )
+                if maybe_alignment is None:
+                    print_status("Fine alignment failed, using click latency")
+                else:
+                    alignment = maybe_alignment
+                    print_status(f"Fine latency: {alignment.latency:.3f} samples")
+                    print_status(f"Clock drift: {alignment.drift * 1e6:.3f} ppm")
+
             train_dry = dry_signal[train_begin:train_end]
-            train_wet = wet_signal[
-                train_begin + latency_samples : train_end + latency_samples
-            ]
+            train_wet = align_wet_signal(wet_signal, alignment, train_begin, train_end)
 
             if has_test_data:
                 test_dry = dry_signal[test_begin:test_end]
-                test_wet = wet_signal[
-                    test_begin + latency_samples : test_end + latency_samples
-                ]
+                test_wet = align_wet_signal(wet_signal, alignment, test_begin, test_end)
             else:
                 test_dry = None
                 test_wet = None
@@ -276,6 +309,7 @@ def run_zip_loader(context: ZipLoaderContext, input_file: str | io.BytesIO):
             if test_dry is not None:
                 assert len(test_dry) == len(test_wet)
 
+            # Without fine alignment every signal below is a view of the recordings
             print_status(f"Training samples available: {len(train_dry)}")
             if test_dry is not None:
                 print_status(f"Testing samples available: {len(test_dry)}")
@@ -286,9 +320,10 @@ def run_zip_loader(context: ZipLoaderContext, input_file: str | io.BytesIO):
             context.signal_dry_test = test_dry
             context.signal_dry_sweep = dry_signal[sweep_begin:sweep_end]
             context.signal_wet_test = test_wet
-            context.signal_wet_sweep = wet_signal[
-                sweep_begin + latency_samples : sweep_end + latency_samples
-            ]
+            context.signal_wet_sweep = align_wet_signal(
+                wet_signal, alignment, sweep_begin, sweep_end
+            )
+            context.alignment = alignment
 
             input_level_dbu = config_json.get("input_level_dbu")
             if input_level_dbu is not None and not isinstance(input_level_dbu, float):
@@ -2,18 +2,86 @@
 # https://www.gnu.org/licenses/gpl-3.0.en.html
 # SPDX-License-Identifier: GPL-3.0-only
 
+import hashlib
+import math
+import os
+
 import numpy as np
+import platformdirs
 import soundfile as sf
-from scipy.signal import resample
+from scipy.signal import resample_poly
+
+from toan.persistence.atomic_write import write_file_atomic
+from toan.persistence.cache_eviction import evict_cache_entries, touch_cache_entry
+
+# Least recently used signals are removed once the cache grows past this
+RESAMPLE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def get_resample_cache_dir() -> str:
+    root_dir = platformdirs.user_cache_dir("toan", "toan")
+    return os.path.join(root_dir, "resampled")
+
+
+def _get_resample_cache_path(sample_rate: int, path: str) -> tuple[str, str]:
+    # Returns the path of the cache entry and the prefix shared by every version
+    # of the file at this rate, an edited file gets a new entry
+    file_stat = os.stat(path)
+    source_key = f"{os.path.abspath(path)}|{sample_rate}"
+    version_key = f"{file_stat.st_mtime_ns}|{file_stat.st_size}"
+    prefix = hashlib.sha1(source_key.encode("utf-8")).hexdigest()
+    digest = hashlib.sha1(version_key.encode("utf-8")).hexdigest()
+    return os.path.join(get_resample_cache_dir(), f"{prefix}-{digest}.npy"), prefix
+
+
+def _write_resample_cache(cache_path: str, prefix: str, signal: np.ndarray) -> None:
+    # The cache only saves time, a failed write leaves the load unaffected
+    cache_dir = get_resample_cache_dir()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Only finished entries, another process may be writing its own version
+        for entry in os.scandir(cache_dir):
+            if (
+                entry.name.startswith(f"{prefix}-")
+                and entry.name.endswith(".npy")
+                and entry.path != cache_path
+            ):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        write_file_atomic(cache_path, lambda out_file: np.save(out_file, signal))
+        evict_cache_entries(cache_dir, RESAMPLE_CACHE_MAX_BYTES, cache_path)
+    except OSError:
+        pass
+
+
+def _resample(signal: np.ndarray, sample_rate: int, source_rate: int) -> np.ndarray:
+    sample_count = int(len(signal) * (sample_rate / source_rate))
+    divisor = math.gcd(sample_rate, source_rate)
+    result = resample_poly(signal, sample_rate // divisor, source_rate // divisor)
+    # Match the length the FFT resampler gave before
+    if len(result) < sample_count:
+        result = np.pad(result, (0, sample_count - len(result)))
+    return result[:sample_count]
 
 
 def load_and_resample_wav(sample_rate: int, path: str) -> np.ndarray:
+    cache_path, cache_prefix = _get_resample_cache_path(sample_rate, path)
+    if os.path.isfile(cache_path):
+        try:
+            result = np.load(cache_path)
+            touch_cache_entry(cache_path)
+            return result
+        except (OSError, ValueError):
+            pass
     this_signal, this_sample_rate = sf.read(path, dtype="float32")
     if len(this_signal.shape) == 2:
         this_signal = this_signal[:, 0]
-    if this_sample_rate != sample_rate:
-        this_sample_count = len(this_signal)
-        desired_sample_count = int(this_sample_count * (sample_rate / this_sample_rate))
-        this_signal = resample(this_signal, desired_sample_count)
+    if this_sample_rate == sample_rate:
+        return this_signal.astype(np.float32)
+    this_signal = _resample(this_signal, sample_rate, this_sample_rate)
     assert type(this_signal) == np.ndarray
-    return this_signal.astype(np.float32)
+    this_signal = this_signal.astype(np.float32)
+    _write_resample_cache(cache_path, cache_prefix, this_signal)
+    return this_signal